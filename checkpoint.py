@@ -0,0 +1,301 @@
+import hashlib
+import itertools
+import json
+import math
+import os
+import pathlib
+from typing import Dict, List, Optional, Tuple, Union
+
+from ortools.linear_solver import linear_solver_pb2, pywraplp
+
+
+TERMINAL_STATUSES = (
+    pywraplp.Solver.OPTIMAL,
+    pywraplp.Solver.INFEASIBLE,
+    pywraplp.Solver.UNBOUNDED,
+    pywraplp.Solver.ABNORMAL,
+    pywraplp.Solver.MODEL_INVALID,
+)
+
+
+def compute_gap(objective: float, bound: float) -> Optional[float]:
+    """
+    Relative optimality gap |bound - objective| / |objective|.
+
+    Returns None when the solver has not produced a finite bound yet
+    (SCIP reports +-1e20 in that case).
+    """
+    if not math.isfinite(bound) or abs(bound) >= 1e20:
+        return None
+    if objective == 0:
+        return 0.0 if bound == 0 else None
+    return abs(bound - objective) / abs(objective)
+
+
+def model_fingerprint(model_proto: linear_solver_pb2.MPModelProto) -> str:
+    """
+    sha256 of the exported model, stored in every checkpoint so a resumed run
+    can tell whether the checkpoint belongs to the model it is solving.
+    """
+    return hashlib.sha256(model_proto.SerializeToString(deterministic=True)).hexdigest()
+
+
+def evaluate(expr: pywraplp.LinearExpr, values: List[float]) -> float:
+    """
+    Value of a variable or linear expression for a solution given as a list
+    indexed like `solver.variables()`.
+    """
+    if isinstance(expr, pywraplp.Variable):
+        return values[expr.index()]
+    return sum(
+        coeff*values[var.index()] if isinstance(var, pywraplp.Variable) else coeff
+        for var, coeff in expr.GetCoeffs().items()
+    )
+
+
+def save_checkpoint(filepath: Union[str, pathlib.Path],
+                    solver: pywraplp.Solver,
+                    first_stage: List[pywraplp.Variable],
+                    best_bound: float,
+                    wall_time: float,
+                    derived: Optional[Dict[str, pywraplp.LinearExpr]] = None,
+                    fingerprint: Optional[str] = None) -> Dict:
+    """
+    Persist the solver's current incumbent to `filepath`.
+
+    The file is written to a temporary sibling first and then moved over
+    the old checkpoint, so a job killed mid-write never leaves a truncated
+    checkpoint behind.
+
+    Parameters
+    ----------
+    filepath : str | pathlib.Path
+        Destination JSON file.
+    solver : pywraplp.Solver
+        Solver holding a feasible solution.
+    first_stage : list[pywraplp.Variable]
+        The portfolio variables (K) reported separately for quick inspection.
+    best_bound : float
+        Best dual bound seen so far.
+    wall_time : float
+        Cumulative solve time in seconds, including previous runs.
+    derived : dict[str, pywraplp.LinearExpr], optional
+        Named expressions over the solver's variables (e.g. quantities
+        substituted out by presolve) whose values are stored alongside the
+        variables in "values".
+    fingerprint : str, optional
+        model_fingerprint of the solved model.
+
+    Returns
+    -------
+    dict
+        The checkpoint that was written.
+    """
+    objective = solver.Objective().Value()
+    solution = [var.solution_value() for var in solver.variables()]
+    values = {var.name(): value for var, value in zip(solver.variables(), solution)}
+    if derived is not None:
+        values.update({name: evaluate(expr, solution) for name, expr in derived.items()})
+    checkpoint = {
+        "model": fingerprint,
+        "objective": objective,
+        "best_bound": best_bound,
+        "gap": compute_gap(objective, best_bound),
+        "wall_time": wall_time,
+        "portfolio": {var.name(): var.solution_value() for var in first_stage},
+        "values": values,
+    }
+    write_checkpoint(filepath, checkpoint)
+    return checkpoint
+
+
+def refresh_checkpoint(filepath: Union[str, pathlib.Path],
+                       best_bound: float,
+                       wall_time: float,
+                       fingerprint: Optional[str] = None) -> Optional[Dict]:
+    """
+    Update the bound, gap and wall time of an existing checkpoint while
+    keeping its incumbent. Does nothing if there is no checkpoint yet or it
+    was written for a model other than `fingerprint`.
+    """
+    checkpoint = load_checkpoint(filepath)
+    if checkpoint is None or checkpoint.get("model") != fingerprint:
+        return None
+    checkpoint["best_bound"] = best_bound
+    checkpoint["gap"] = compute_gap(checkpoint["objective"], best_bound)
+    checkpoint["wall_time"] = wall_time
+    write_checkpoint(filepath, checkpoint)
+    return checkpoint
+
+
+def write_checkpoint(filepath: Union[str, pathlib.Path], checkpoint: Dict):
+    filepath = pathlib.Path(filepath)
+    tmp_filepath = filepath.with_name(filepath.name + ".tmp")
+    with open(tmp_filepath, mode="w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filepath, filepath)
+
+
+def load_checkpoint(filepath: Union[str, pathlib.Path]) -> Optional[Dict]:
+    filepath = pathlib.Path(filepath)
+    if not filepath.exists():
+        return None
+    with open(filepath, mode="r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def apply_hint(solver: pywraplp.Solver, values: Dict[str, float]):
+    """
+    Hand a (possibly partial) solution, keyed by variable name, to the solver
+    as its starting solution. Names unknown to this model are ignored.
+    """
+    variables = []
+    hint_values = []
+    for name, value in values.items():
+        var = solver.LookupVariable(name)
+        if var is None:
+            continue
+        variables.append(var)
+        hint_values.append(round(value) if var.integer() else value)
+    solver.SetHint(variables, hint_values)
+
+
+def is_better(objective: float, reference: Optional[float], is_maximization: bool) -> bool:
+    if reference is None:
+        return True
+    return objective > reference if is_maximization else objective < reference
+
+
+def solve_with_checkpoints(solver: pywraplp.Solver,
+                           filepath: Union[str, pathlib.Path],
+                           first_stage: List[pywraplp.Variable],
+                           time_slice: float = 60,
+                           time_limit: Optional[float] = None,
+                           num_threads: int = 16,
+                           max_stalled_slices: int = 3,
+                           derived: Optional[Dict[str, pywraplp.LinearExpr]] = None) -> Tuple[int, float]:
+    """
+    Solve in time slices, persisting the incumbent after every slice.
+
+    pywraplp exposes no incumbent callback and SCIP cannot be re-solved
+    once it stopped on a time limit, so the built model is exported once
+    and every slice of `time_slice` seconds runs on a fresh SCIP instance
+    loaded from it. After each slice an improved incumbent is written to
+    `filepath` and handed to the next slice as its hint. If `filepath`
+    already holds a checkpoint (e.g. from a killed job) it is the hint of
+    the first slice. A checkpoint written for a different model (another
+    instance, seed or presolve setting) still serves as hint, but its
+    objective, bound and wall time are ignored and the first incumbent of
+    this run replaces it. Every slice that ends without a terminal status doubles
+    the next slice length and shifts SCIP's random seed, so a restarted
+    search gets longer and explores differently instead of repeating the
+    previous slice. The checkpoint's bound and wall time are refreshed after
+    every slice. Without `time_limit` the run stops once
+    `max_stalled_slices` slices in a row improved neither the incumbent nor
+    the bound. The best solution is loaded back into `solver`, so callers
+    read values from it as after a plain `solver.Solve()`.
+
+    Parameters
+    ----------
+    solver : pywraplp.Solver
+        Fully built model.
+    filepath : str | pathlib.Path
+        Checkpoint JSON file, read on start and rewritten on improvement.
+    first_stage : list[pywraplp.Variable]
+        Portfolio variables stored in the checkpoint's "portfolio" field.
+    time_slice : float
+        Seconds per slice.
+    time_limit : float, optional
+        Total seconds for this run; if None, runs until a terminal status or
+        until the search stalls.
+    num_threads : int
+        Threads given to every slice.
+    max_stalled_slices : int
+        Consecutive slices without progress after which a run without
+        `time_limit` gives up.
+    derived : dict[str, pywraplp.LinearExpr], optional
+        Named expressions over `solver`'s variables whose values are stored
+        in the checkpoint, see save_checkpoint.
+
+    Returns
+    -------
+    int
+        OPTIMAL/FEASIBLE if an incumbent exists, else the last slice status.
+    float
+        Best dual bound over all slices and previous runs; tighter than the
+        bound `solver` reports after the solution is loaded back.
+    """
+    model_proto = linear_solver_pb2.MPModelProto()
+    solver.ExportModelToProto(model_proto)
+    is_maximization = model_proto.maximize
+    fingerprint = model_fingerprint(model_proto)
+    checkpoint = load_checkpoint(filepath)
+    hint = None
+    best_objective = None
+    checkpoint_objective = None
+    best_bound = math.inf if is_maximization else -math.inf
+    previous_wall_time = 0.
+    if checkpoint is not None:
+        hint = checkpoint["values"]
+        if checkpoint.get("model") == fingerprint:
+            checkpoint_objective = checkpoint["objective"]
+            previous_wall_time = checkpoint["wall_time"]
+            best_bound = checkpoint["best_bound"]
+        else:
+            print(f"Checkpoint {filepath} belongs to another model, using it as hint only")
+
+    best_response = None
+    elapsed = 0.
+    stalled_slices = 0
+    status = pywraplp.Solver.NOT_SOLVED
+    for seed_shift in itertools.count():
+        if time_limit is not None and elapsed >= time_limit:
+            break
+        current_slice = time_slice if time_limit is None else min(time_slice, time_limit - elapsed)
+        slice_solver = pywraplp.Solver.CreateSolver("SCIP")
+        slice_solver.LoadModelFromProtoKeepNames(model_proto)
+        slice_solver.SetNumThreads(num_threads)
+        slice_solver.SetTimeLimit(max(1, int(current_slice*1000)))
+        slice_solver.SetSolverSpecificParametersAsString(f"randomization/randomseedshift = {seed_shift}")
+        if hint is not None:
+            apply_hint(slice_solver, hint)
+        status = slice_solver.Solve()
+        elapsed += slice_solver.wall_time()/1000
+        improved = False
+        saved = False
+        if status == pywraplp.Solver.OPTIMAL or status == pywraplp.Solver.FEASIBLE:
+            # every slice restarts the search, so any slice's bound is valid
+            bound = slice_solver.Objective().BestBound()
+            if is_better(best_bound, bound, is_maximization):
+                best_bound = bound
+                improved = True
+            objective = slice_solver.Objective().Value()
+            if is_better(objective, best_objective, is_maximization):
+                best_objective = objective
+                best_response = linear_solver_pb2.MPSolutionResponse()
+                slice_solver.FillSolutionResponseProto(best_response)
+                hint = {var.name(): var.solution_value() for var in slice_solver.variables()}
+                improved = True
+            # a resumed run only overwrites the checkpoint it started from once it beats it
+            if is_better(objective, checkpoint_objective, is_maximization):
+                checkpoint_objective = objective
+                slice_first_stage = [slice_solver.variable(var.index()) for var in first_stage]
+                save_checkpoint(filepath, slice_solver, slice_first_stage, best_bound, previous_wall_time + elapsed, derived, fingerprint)
+                saved = True
+        if not saved:
+            refresh_checkpoint(filepath, best_bound, previous_wall_time + elapsed, fingerprint)
+        if status in TERMINAL_STATUSES:
+            break
+        time_slice *= 2
+        stalled_slices = 0 if improved else stalled_slices + 1
+        if time_limit is None and stalled_slices >= max_stalled_slices:
+            break
+
+    if best_response is None:
+        return status, best_bound
+    solver.LoadSolutionFromProto(best_response)
+    if status == pywraplp.Solver.OPTIMAL:
+        return status, best_bound
+    return pywraplp.Solver.FEASIBLE, best_bound
@@ -0,0 +1,61 @@
+from typing import Callable, Dict, List, Tuple
+
+from ortools.linear_solver import linear_solver_pb2, pywraplp
+
+from checkpoint import compute_gap
+
+
+def solve_relaxation(model_proto: linear_solver_pb2.MPModelProto) -> Tuple[pywraplp.Solver, int]:
+    # GLOP only: PDLP stops at its default tolerances several percent away
+    # from the LP optimum and returns no solution on a time limit, so it can
+    # provide neither a trustworthy bound nor a repaired plan
+    lp_solver = pywraplp.Solver.CreateSolver("GLOP")
+    lp_solver.LoadModelFromProto(model_proto)
+    status = lp_solver.Solve()
+    return lp_solver, status
+
+
+def solve_lp_and_repair(solver: pywraplp.Solver,
+                        round_and_repair: Callable[[List[float]], Dict[int, float]]) -> Dict:
+    """
+    LP-relaxation-plus-repair heuristic for a built MILP.
+
+    The model is exported, its integrality dropped and the relaxation solved
+    with GLOP. `round_and_repair` maps the LP values (indexed like
+    `solver.variables()`) to fixed values for the integer variables. With
+    those fixed, the remaining continuous LP is solved again and its solution
+    loaded into `solver`, so callers read variable values as after a plain
+    `solver.Solve()`.
+
+    Returns
+    -------
+    dict
+        objective, lp_bound and gap (relative distance between the two).
+    """
+    model_proto = linear_solver_pb2.MPModelProto()
+    solver.ExportModelToProto(model_proto)
+    for var_proto in model_proto.variable:
+        var_proto.is_integer = False
+
+    lp_solver, status = solve_relaxation(model_proto)
+    if status != pywraplp.Solver.OPTIMAL:
+        raise RuntimeError(f"LP relaxation not solved to optimality, status {status}")
+    lp_bound = lp_solver.Objective().Value()
+    lp_values = [var.solution_value() for var in lp_solver.variables()]
+
+    for index, value in round_and_repair(lp_values).items():
+        model_proto.variable[index].lower_bound = value
+        model_proto.variable[index].upper_bound = value
+    repaired_solver, status = solve_relaxation(model_proto)
+    if status != pywraplp.Solver.OPTIMAL:
+        raise RuntimeError(f"Repaired LP not solved to optimality, status {status}")
+    response = linear_solver_pb2.MPSolutionResponse()
+    repaired_solver.FillSolutionResponseProto(response)
+    solver.LoadSolutionFromProto(response)
+
+    objective = repaired_solver.Objective().Value()
+    return {
+        "objective": objective,
+        "lp_bound": lp_bound,
+        "gap": compute_gap(objective, lp_bound),
+    }
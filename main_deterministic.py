@@ -1,7 +1,11 @@
-from typing import List
+import math
+from typing import Dict, List, Optional, Tuple
 
 from ortools.linear_solver import pywraplp
 
+from checkpoint import evaluate, solve_with_checkpoints
+from lp_heuristic import solve_lp_and_repair
+from model_cache import ModelCache
 from problem_deterministic import RPP
 
 
@@ -17,8 +21,10 @@ def nested_shape(lst):
 class Variables:
     def __init__(self, 
                  solver: pywraplp.Solver,
-                 problem: RPP):
-        self.capitals = [solver.NumVar(-solver.infinity(), solver.infinity(), f"F_{period}") for period in range(problem.num_periods+1)]
+                 problem: RPP,
+                 presolve: bool=False):
+        if not presolve:
+            self.capitals = [solver.NumVar(-solver.infinity(), solver.infinity(), f"F_{period}") for period in range(problem.num_periods+1)]
         # num_testers[m]
         self.num_testers = [None]+[solver.IntVar(problem.initial_num_testers[(m,)], solver.infinity(), f"K_({m})") for m in range(1, problem.num_testers+1)]
         # num_handlers[h][a]
@@ -67,11 +73,6 @@ class Variables:
             ]
             for p in range(problem.num_periods+1)
         ]
-        #product_capacity_loading_qtys[p][t]
-        self.product_capacity_loading_qtys = [
-            [solver.NumVar(-solver.infinity(), solver.infinity(), f"S_({p},{t})") for t in range(problem.num_products+1)]
-            for p in range(problem.num_periods+1)
-        ]
         self.Spos = [
             [solver.NumVar(0, solver.infinity(), f"Spos_({p},{t})") for t in range(problem.num_products+1)]
             for p in range(problem.num_periods+1)
@@ -80,11 +81,30 @@ class Variables:
             [solver.NumVar(0, solver.infinity(), f"Sneg_({p},{t})") for t in range(problem.num_products+1)]
             for p in range(problem.num_periods+1)
         ]
-        #product_capacity_loading_costs[p][t]
-        self.product_capacity_loading_costs = [
-            [solver.NumVar(-solver.infinity(), solver.infinity(), f"V_({p},{t})") for t in range(problem.num_products+1)]
-            for p in range(problem.num_periods+1)
-        ]
+        if presolve:
+            # S, V and F are only aliases, defined by (5prelude), (7) and (8).
+            # Keep them as expressions so their values can still be read with
+            # solution_value(); build_model fills capitals[1:] in (8).
+            self.capitals = [problem.capital] + [None]*problem.num_periods
+            self.product_capacity_loading_qtys = [
+                [self.Spos[p][t] - self.Sneg[p][t] for t in range(problem.num_products+1)]
+                for p in range(problem.num_periods+1)
+            ]
+            self.product_capacity_loading_costs = [[None]*(problem.num_products+1)] + [
+                [None] + [problem.excess_production_cost[p,t]*self.Spos[p][t] + problem.shortage_cost[p,t]*self.Sneg[p][t] for t in range(1, problem.num_products+1)]
+                for p in range(1, problem.num_periods+1)
+            ]
+        else:
+            #product_capacity_loading_qtys[p][t]
+            self.product_capacity_loading_qtys = [
+                [solver.NumVar(-solver.infinity(), solver.infinity(), f"S_({p},{t})") for t in range(problem.num_products+1)]
+                for p in range(problem.num_periods+1)
+            ]
+            #product_capacity_loading_costs[p][t]
+            self.product_capacity_loading_costs = [
+                [solver.NumVar(-solver.infinity(), solver.infinity(), f"V_({p},{t})") for t in range(problem.num_products+1)]
+                for p in range(problem.num_periods+1)
+            ]
         self.y = [
             [solver.BoolVar(f"y_({p},{t})") for t in range(problem.num_products+1)]
             for p in range(problem.num_periods+1)
@@ -94,9 +114,9 @@ class Variables:
         
 
 
-def solve(problem: RPP):
+def build_model(problem: RPP, presolve: bool=False) -> Tuple[pywraplp.Solver, Variables]:
     solver: pywraplp.Solver = pywraplp.Solver.CreateSolver("SCIP")
-    vars = Variables(solver, problem)
+    vars = Variables(solver, problem, presolve)
     # Constraint (2)
     for p in problem.periods:
         for m in problem.testers:
@@ -152,7 +172,8 @@ def solve(problem: RPP):
         for t in problem.products:
             solver.Add(vars.Spos[p][t] <= vars.BigM * vars.y[p][t])
             solver.Add(vars.Sneg[p][t] <= vars.BigM * (1 - vars.y[p][t]))
-            solver.Add(vars.product_capacity_loading_qtys[p][t] == vars.Spos[p][t] - vars.Sneg[p][t])
+            if not presolve:
+                solver.Add(vars.product_capacity_loading_qtys[p][t] == vars.Spos[p][t] - vars.Sneg[p][t])
     for t in problem.products:
         solver.Add(vars.product_capacity_loading_qtys[0][t] == problem.initial_capacity_loading_qty[(t,)])
     # Constraint (5)
@@ -174,23 +195,30 @@ def solve(problem: RPP):
             solver.Add(num_produced_main <= problem.demands_mto[p,t])
 
     # Constraint (7)
-    for p in problem.periods:
-        for t in problem.products:
-            excess_cost = problem.excess_production_cost[p,t]*vars.Spos[p][t]
-            shortage_cost = problem.shortage_cost[p,t]*vars.Sneg[p][t]
-            solver.Add(vars.product_capacity_loading_costs[p][t] == excess_cost + shortage_cost)
+    if not presolve:
+        for p in problem.periods:
+            for t in problem.products:
+                excess_cost = problem.excess_production_cost[p,t]*vars.Spos[p][t]
+                shortage_cost = problem.shortage_cost[p,t]*vars.Sneg[p][t]
+                solver.Add(vars.product_capacity_loading_costs[p][t] == excess_cost + shortage_cost)
 
     # Constraint (8prelude)
-    solver.Add(vars.capitals[0] == problem.capital)
+    if not presolve:
+        solver.Add(vars.capitals[0] == problem.capital)
     # Constraint (8)
     for p in problem.periods:
         tester_borrow_total_cost = sum(problem.tester_borrow_prices[p,m,z]*vars.num_acquired_testers[p][m][z] for m in problem.testers for z in problem.tester_channels)
         handler_borrow_total_cost = sum(problem.handler_borrow_prices[p,h,a,z]*vars.num_acquired_handlers[p][h][a][z] for z in problem.handler_channels for a in problem.handlers for h in problem.handler_categories)
         inventory_cost = sum(vars.product_capacity_loading_costs[p][t] for t in problem.products)
         total_profit_mts = sum(problem.product_profits[p,t]*problem.demands_mts[p,t] for t in problem.products)
-        total_profit_mto = sum(problem.product_profits[p,t]*vars.num_produced_main[p][m][t] for t in problem.products for m in problem.testers)
+        total_profit_mto = sum(problem.product_profits[p,t]*problem.tester_ablities[m, t]*vars.num_produced_main[p][m][t] for t in problem.products for m in problem.testers)
         last_capital = vars.capitals[p-1]*(1+problem.interest_rates[p])
-        solver.Add(vars.capitals[p] == last_capital - tester_borrow_total_cost - handler_borrow_total_cost - inventory_cost + total_profit_mts + total_profit_mto)
+        capital = last_capital - tester_borrow_total_cost - handler_borrow_total_cost - inventory_cost + total_profit_mts + total_profit_mto
+        if presolve:
+            # unrolled, F_T is F0 and every period's cash flow compounded to T
+            vars.capitals[p] = capital
+        else:
+            solver.Add(vars.capitals[p] == capital)
 
     # Objective
     last_period = max(problem.periods)
@@ -202,15 +230,145 @@ def solve(problem: RPP):
     handler_purchase_cost = sum((problem.handler_initial_prices[h,a]-problem.handler_salvage_prices[h,a])*(vars.num_handlers[h][a]-problem.initial_num_handlers[h,a]) for h in problem.handler_categories for a in problem.handlers)
     obj = last_capital - tester_purchase_cost - handler_purchase_cost
     solver.Maximize(obj)
-    solver.SetNumThreads(16)
-    status = solver.Solve()
+    return solver, vars
+
+
+def build_model_cached(problem: RPP,
+                       cache: ModelCache,
+                       presolve: bool=False) -> Tuple[pywraplp.Solver, Variables]:
+    key = cache.key(problem, build_model, presolve=presolve)
+    cached = cache.load(key, Variables)
+    if cached is not None:
+        return cached
+    solver, vars = build_model(problem, presolve)
+    cache.store(key, solver, vars)
+    return solver, vars
+
+
+def eliminated_expressions(problem: RPP, vars: Variables) -> Dict[str, pywraplp.LinearExpr]:
+    """
+    S, V and F of a presolved model, which exist only as expressions, under
+    the names the variables carry without presolve.
+    """
+    expressions = {}
+    for p in range(problem.num_periods+1):
+        for t in problem.products:
+            expressions[f"S_({p},{t})"] = vars.product_capacity_loading_qtys[p][t]
+    for p in problem.periods:
+        for t in problem.products:
+            expressions[f"V_({p},{t})"] = vars.product_capacity_loading_costs[p][t]
+        expressions[f"F_{p}"] = vars.capitals[p]
+    return expressions
+
+
+def solve(problem: RPP,
+          checkpoint_path: Optional[str]=None,
+          time_slice: float=60,
+          time_limit: Optional[float]=None,
+          presolve: bool=False,
+          cache: Optional[ModelCache]=None,
+          num_threads: int=16) -> Dict:
+    if cache is not None:
+        solver, vars = build_model_cached(problem, cache, presolve)
+    else:
+        solver, vars = build_model(problem, presolve)
+    solver.SetNumThreads(num_threads)
+    first_stage = vars.num_testers[1:] + [vars.num_handlers[h][a] for h in problem.handler_categories for a in problem.handlers]
+    eliminated = eliminated_expressions(problem, vars) if presolve else {}
+    best_bound = None
+    if checkpoint_path is not None:
+        status, best_bound = solve_with_checkpoints(solver, checkpoint_path, first_stage, time_slice, time_limit, num_threads, derived=eliminated)
+    else:
+        if time_limit is not None:
+            solver.SetTimeLimit(int(time_limit*1000))
+        status = solver.Solve()
+    report = {"status": status, "objective": None, "best_bound": None, "portfolio": {}, "eliminated": {}}
     if status == pywraplp.Solver.OPTIMAL or status == pywraplp.Solver.FEASIBLE:
         print("Objective =", solver.Objective().Value())
+        report["objective"] = solver.Objective().Value()
+        report["best_bound"] = solver.Objective().BestBound() if best_bound is None else best_bound
+        report["portfolio"] = {var.name(): var.solution_value() for var in first_stage}
+        # presolve substitutes out S, V and F; recover their values here
+        report["eliminated"] = {name: expr.solution_value() for name, expr in eliminated.items()}
     print(status)
     for var in solver.variables():
         val = var.solution_value()
         # if abs(val) > 1e-6:   # print only non-zero variables (optional)
         print(f"{var.name():<30s} = {val:,.6f}")
+    for name, val in report["eliminated"].items():
+        print(f"{name:<30s} = {val:,.6f}")
+    return report
+
+
+def round_and_repair(problem: RPP,
+                     vars: Variables,
+                     lp_values: List[float]) -> Dict[int, float]:
+    """
+    Integer values for the LP-relaxation-plus-repair heuristic, keyed by
+    variable index. Portfolio counts K are rounded up (never below K0); the
+    borrowed X then cover whatever is left of the LP's tester (2) and handler
+    (4) workload, greedily from the cheapest channel. y follows the sign of
+    the LP inventory S.
+    """
+    def value(var: pywraplp.LinearExpr) -> float:
+        return evaluate(var, lp_values)
+
+    fixed = {}
+    for m in problem.testers:
+        fixed[vars.num_testers[m].index()] = max(problem.initial_num_testers[(m,)], math.ceil(value(vars.num_testers[m]) - 1e-6))
+    for h in problem.handler_categories:
+        for a in problem.handlers:
+            fixed[vars.num_handlers[h][a].index()] = max(problem.initial_num_handlers[h,a], math.ceil(value(vars.num_handlers[h][a]) - 1e-6))
+
+    # Constraint (2)
+    for p in problem.periods:
+        for m in problem.testers:
+            total_utilization_rate = problem.tester_work_hours[p, m]*problem.tester_target_utils[p, m]
+            workload = sum(
+                (problem.tester_ablities[m, t] * value(vars.num_produced_main[p][m][t]))/(problem.tester_throughputs[m,t]*total_utilization_rate)
+                for t in problem.products
+            )
+            deficit = max(0, math.ceil(workload - fixed[vars.num_testers[m].index()] - 1e-6))
+            cheapest = min(problem.tester_channels, key=lambda z: problem.tester_borrow_prices[p,m,z])
+            for z in problem.tester_channels:
+                fixed[vars.num_acquired_testers[p][m][z].index()] = deficit if z == cheapest else 0
+
+    # Constraint (4)
+    for p in problem.periods:
+        for a in problem.handlers:
+            for h in problem.handler_categories:
+                total_utilization_rate = problem.handler_work_hours[p,h,a]*problem.handler_target_utils[p,h,a]
+                workload = sum(
+                        (problem.handler_ablities[m,h,a,t]*value(vars.num_produced_by_handler_categories[p][m][h][a][t]))/(problem.handler_throughputs[m,h,a,t]*total_utilization_rate)
+                        for m in problem.testers for t in problem.products
+                    )
+                deficit = max(0, math.ceil(workload - fixed[vars.num_handlers[h][a].index()] - 1e-6))
+                cheapest = min(problem.handler_channels, key=lambda z: problem.handler_borrow_prices[p,h,a,z])
+                for z in problem.handler_channels:
+                    fixed[vars.num_acquired_handlers[p][h][a][z].index()] = deficit if z == cheapest else 0
+
+    for p in range(problem.num_periods+1):
+        for t in problem.products:
+            fixed[vars.y[p][t].index()] = 1 if value(vars.product_capacity_loading_qtys[p][t]) >= 0 else 0
+    return fixed
+
+
+def solve_heuristic(problem: RPP,
+                    presolve: bool=False,
+                    cache: Optional[ModelCache]=None) -> Dict:
+    if cache is not None:
+        solver, vars = build_model_cached(problem, cache, presolve)
+    else:
+        solver, vars = build_model(problem, presolve)
+    report = solve_lp_and_repair(solver, lambda lp_values: round_and_repair(problem, vars, lp_values))
+    first_stage = vars.num_testers[1:] + [vars.num_handlers[h][a] for h in problem.handler_categories for a in problem.handlers]
+    report["portfolio"] = {var.name(): var.solution_value() for var in first_stage}
+    eliminated = eliminated_expressions(problem, vars) if presolve else {}
+    report["eliminated"] = {name: expr.solution_value() for name, expr in eliminated.items()}
+    print("Objective =", report["objective"])
+    print("LP bound =", report["lp_bound"])
+    print("Gap =", report["gap"])
+    return report
 
 def run():
     problem = RPP()
@@ -0,0 +1,387 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+from ortools.linear_solver import pywraplp
+
+import main_stochastic
+from checkpoint import evaluate, solve_with_checkpoints
+from lp_heuristic import solve_lp_and_repair
+from model_cache import ModelCache
+from problem_multistage import RPP
+
+
+class Variables:
+    def __init__(self,
+                 solver: pywraplp.Solver,
+                 problem: RPP,
+                 presolve: bool=False):
+        # first-stage portfolio, decided at the root
+        # num_testers[m]
+        self.num_testers = [None]+[solver.IntVar(problem.initial_num_testers[(m,)], solver.infinity(), f"K_({m})") for m in range(1, problem.num_testers+1)]
+        # num_handlers[h][a]
+        self.num_handlers = [[None]] + [
+                [None] + [solver.IntVar(problem.initial_num_handlers[(h, a)], solver.infinity(), f"K^{h}_{a}") for a in range(1, problem.num_handlers+1)]
+                for h in range(1, problem.num_handler_categories+1)
+            ]
+        # recourse, one copy per tree node; node n decides for period
+        # node_periods[n] knowing the demands on its path from the root.
+        # Index 0 is the root, which only carries the initial state.
+        if not presolve:
+            # capitals[n]
+            self.capitals = [solver.NumVar(-solver.infinity(), solver.infinity(), f"F_({n})") for n in range(problem.num_nodes+1)]
+        # num_acquired_testers[n][m][z]
+        self.num_acquired_testers = [None] + [
+            [
+                [solver.IntVar(0, solver.infinity(), f"X_({n},{m},{z})") for z in range(problem.num_tester_channels+1)]
+                for m in range(problem.num_testers+1)
+            ]
+            for n in problem.nodes
+        ]
+        # num_acquired_handlers[n][h][a][z]
+        self.num_acquired_handlers = [None] + [
+            [
+                [
+                    [solver.IntVar(0, solver.infinity(), f"X^{h}_({n},{a},{z})") for z in range(problem.num_handler_channels+1)]
+                    for a in range(problem.num_handlers+1)
+                ]
+                for h in range(problem.num_handler_categories+1)
+            ]
+            for n in problem.nodes
+        ]
+        # num_produced_main[n][m][t]
+        self.num_produced_main = [None] + [
+            [
+                [solver.NumVar(0, solver.infinity(), f"Q_({n},{m},{t})") for t in range(problem.num_products+1)]
+                for m in range(problem.num_testers+1)
+            ]
+            for n in problem.nodes
+        ]
+        # num_produced_combined[n][m][h][a][t]
+        self.num_produced_by_handler_categories = [None] + [
+            [
+                [
+                    [
+                        [solver.NumVar(0, solver.infinity(), f"Q^{h}_({n},{m},{a},{t})") for t in range(problem.num_products+1)]
+                        for a in range(problem.num_handlers+1)
+                    ]
+                    for h in range(problem.num_handler_categories+1)
+                ]
+                for m in range(problem.num_testers+1)
+            ]
+            for n in problem.nodes
+        ]
+        self.Spos = [
+            [solver.NumVar(0, solver.infinity(), f"Spos_({n},{t})") for t in range(problem.num_products+1)]
+            for n in range(problem.num_nodes+1)
+        ]
+        self.Sneg = [
+            [solver.NumVar(0, solver.infinity(), f"Sneg_({n},{t})") for t in range(problem.num_products+1)]
+            for n in range(problem.num_nodes+1)
+        ]
+        if presolve:
+            # S, V and F are only aliases, defined by (5prelude), (7) and (8).
+            # Keep them as expressions so their values can still be read with
+            # solution_value(); build_model fills capitals[1:] in (8).
+            self.capitals = [problem.capital] + [None]*problem.num_nodes
+            self.product_capacity_loading_qtys = [
+                [self.Spos[n][t] - self.Sneg[n][t] for t in range(problem.num_products+1)]
+                for n in range(problem.num_nodes+1)
+            ]
+            self.product_capacity_loading_costs = [[None]*(problem.num_products+1)] + [
+                [None] + [problem.excess_production_cost[problem.node_periods[n],t]*self.Spos[n][t] + problem.shortage_cost[problem.node_periods[n],t]*self.Sneg[n][t] for t in range(1, problem.num_products+1)]
+                for n in problem.nodes
+            ]
+        else:
+            #product_capacity_loading_qtys[n][t]
+            self.product_capacity_loading_qtys = [
+                [solver.NumVar(-solver.infinity(), solver.infinity(), f"S_({n},{t})") for t in range(problem.num_products+1)]
+                for n in range(problem.num_nodes+1)
+            ]
+            #product_capacity_loading_costs[n][t]
+            self.product_capacity_loading_costs = [
+                [solver.NumVar(-solver.infinity(), solver.infinity(), f"V_({n},{t})") for t in range(problem.num_products+1)]
+                for n in range(problem.num_nodes+1)
+            ]
+        self.y = [
+            [solver.BoolVar(f"y_({n},{t})") for t in range(problem.num_products+1)]
+            for n in range(problem.num_nodes+1)
+        ]
+        self.BigM = 999999999999
+
+
+def build_model(problem: RPP, presolve: bool=False) -> Tuple[pywraplp.Solver, Variables]:
+    """
+    Node-based multistage model: the constraints of main_stochastic.build_model
+    written once per tree node instead of once per scenario and period, with
+    the inventory and capital of period p-1 taken from the node's parent.
+    Scenarios sharing a history up to period p share its variables, which
+    makes borrowing non-anticipative.
+    """
+    solver: pywraplp.Solver = pywraplp.Solver.CreateSolver("SCIP")
+    vars = Variables(solver, problem, presolve)
+    for n in problem.nodes:
+        p = problem.node_periods[n]
+        # Constraint (2)
+        for m in problem.testers:
+            num_available_testers = (
+                vars.num_testers[m]
+                + sum(vars.num_acquired_testers[n][m][z] for z in problem.tester_channels)
+            )
+            total_utilization_rate = (
+                problem.tester_work_hours[p, m]
+                * problem.tester_target_utils[p, m]
+            )
+            num_produced_main = sum(
+                (problem.tester_ablities[m, t] * vars.num_produced_main[n][m][t])/(problem.tester_throughputs[m,t]*total_utilization_rate)
+                for t in problem.products
+            )
+            solver.Add(
+                num_available_testers >= num_produced_main,
+                f"TesterCapacity[n={n},m={m}]"
+            )
+
+        # Constraint (3)
+        for m in problem.testers:
+            for h in problem.handler_categories:
+                for t in problem.products:
+                    sum_produced_by_categories = sum(
+                        problem.handler_ablities[m,h,a,t]*vars.num_produced_by_handler_categories[n][m][h][a][t]
+                        for a in problem.handlers
+                    )
+                    solver.Add(sum_produced_by_categories == vars.num_produced_main[n][m][t])
+
+        # Constraint (4)
+        for a in problem.handlers:
+            for h in problem.handler_categories:
+                num_available_handlers = vars.num_handlers[h][a] + sum(vars.num_acquired_handlers[n][h][a][z] for z in problem.handler_channels)
+                total_utilization_rate = problem.handler_work_hours[p,h,a]*problem.handler_target_utils[p,h,a]
+                sum_produced_by_categories = sum(
+                        (problem.handler_ablities[m,h,a,t]*vars.num_produced_by_handler_categories[n][m][h][a][t])/(problem.handler_throughputs[m,h,a,t]*total_utilization_rate)
+                        for m in problem.testers for t in problem.products
+                    )
+                solver.Add(num_available_handlers >= sum_produced_by_categories)
+
+    # Constraint (5prelude)
+    for n in range(problem.num_nodes+1):
+        for t in problem.products:
+            solver.Add(vars.Spos[n][t] <= vars.BigM * vars.y[n][t])
+            solver.Add(vars.Sneg[n][t] <= vars.BigM * (1 - vars.y[n][t]))
+            if not presolve:
+                solver.Add(vars.product_capacity_loading_qtys[n][t] == vars.Spos[n][t] - vars.Sneg[n][t])
+    for t in problem.products:
+        solver.Add(vars.product_capacity_loading_qtys[0][t] == problem.initial_capacity_loading_qty[(t,)])
+
+    for n in problem.nodes:
+        p = problem.node_periods[n]
+        parent = problem.node_parents[n]
+        # Constraint (5)
+        for t in problem.products:
+            num_produced_main = sum(
+                (problem.tester_ablities[m, t] * vars.num_produced_main[n][m][t])
+                for m in problem.testers
+            )
+            solver.Add(vars.product_capacity_loading_qtys[n][t] == vars.product_capacity_loading_qtys[parent][t] + num_produced_main - problem.node_demands_mts[n,t])
+
+        # Constraint (6)
+        for t in problem.products:
+            num_produced_main = sum(
+                (problem.tester_ablities[m, t] * vars.num_produced_main[n][m][t])
+                for m in problem.testers
+            )
+            solver.Add(num_produced_main <= problem.node_demands_mto[n,t])
+
+        # Constraint (7)
+        if not presolve:
+            for t in problem.products:
+                excess_cost = problem.excess_production_cost[p,t]*vars.Spos[n][t]
+                shortage_cost = problem.shortage_cost[p,t]*vars.Sneg[n][t]
+                solver.Add(vars.product_capacity_loading_costs[n][t] == excess_cost + shortage_cost)
+
+    # Constraint (8prelude)
+    if not presolve:
+        solver.Add(vars.capitals[0] == problem.capital)
+    # Constraint (8), parents come before their children
+    for n in problem.nodes:
+        p = problem.node_periods[n]
+        parent = problem.node_parents[n]
+        tester_borrow_total_cost = sum(problem.tester_borrow_prices[p,m,z]*vars.num_acquired_testers[n][m][z] for m in problem.testers for z in problem.tester_channels)
+        handler_borrow_total_cost = sum(problem.handler_borrow_prices[p,h,a,z]*vars.num_acquired_handlers[n][h][a][z] for z in problem.handler_channels for a in problem.handlers for h in problem.handler_categories)
+        inventory_cost = sum(vars.product_capacity_loading_costs[n][t] for t in problem.products)
+        total_profit_mts = sum(problem.product_profits[p,t]*problem.node_demands_mts[n,t] for t in problem.products)
+        total_profit_mto = sum(problem.product_profits[p,t]*problem.tester_ablities[m, t]*vars.num_produced_main[n][m][t] for t in problem.products for m in problem.testers)
+        last_capital = vars.capitals[parent]*(1+problem.interest_rates[p])
+        capital = last_capital - tester_borrow_total_cost - handler_borrow_total_cost - inventory_cost + total_profit_mts + total_profit_mto
+        if presolve:
+            vars.capitals[n] = capital
+        else:
+            solver.Add(vars.capitals[n] == capital)
+
+    # Objective: expected discounted final capital over the leaves
+    compound_interest = 1
+    for p in problem.periods:
+        compound_interest *= (1 + problem.interest_rates[p])
+    last_capital = sum(problem.node_probabilities[n]*vars.capitals[n] for n in problem.leaves)/compound_interest
+    tester_purchase_cost = sum((problem.tester_initial_prices[(m,)]- problem.tester_salvage_prices[(m,)])*(vars.num_testers[m]-problem.initial_num_testers[(m,)]) for m in problem.testers)
+    handler_purchase_cost = sum((problem.handler_initial_prices[h,a]-problem.handler_salvage_prices[h,a])*(vars.num_handlers[h][a]-problem.initial_num_handlers[h,a]) for h in problem.handler_categories for a in problem.handlers)
+    obj = last_capital - tester_purchase_cost - handler_purchase_cost
+    solver.Maximize(obj)
+    return solver, vars
+
+
+def build_model_cached(problem: RPP,
+                       cache: ModelCache,
+                       presolve: bool=False) -> Tuple[pywraplp.Solver, Variables]:
+    key = cache.key(problem, build_model, presolve=presolve)
+    cached = cache.load(key, Variables)
+    if cached is not None:
+        return cached
+    solver, vars = build_model(problem, presolve)
+    cache.store(key, solver, vars)
+    return solver, vars
+
+
+def eliminated_expressions(problem: RPP, vars: Variables) -> Dict[str, pywraplp.LinearExpr]:
+    """
+    S, V and F of a presolved model, which exist only as expressions, under
+    the names the variables carry without presolve.
+    """
+    expressions = {}
+    for t in problem.products:
+        expressions[f"S_(0,{t})"] = vars.product_capacity_loading_qtys[0][t]
+    for n in problem.nodes:
+        for t in problem.products:
+            expressions[f"S_({n},{t})"] = vars.product_capacity_loading_qtys[n][t]
+            expressions[f"V_({n},{t})"] = vars.product_capacity_loading_costs[n][t]
+        expressions[f"F_({n})"] = vars.capitals[n]
+    return expressions
+
+
+def solve(problem: RPP,
+          checkpoint_path: Optional[str]=None,
+          time_slice: float=60,
+          time_limit: Optional[float]=None,
+          presolve: bool=False,
+          cache: Optional[ModelCache]=None,
+          num_threads: int=16) -> Dict:
+    if cache is not None:
+        solver, vars = build_model_cached(problem, cache, presolve)
+    else:
+        solver, vars = build_model(problem, presolve)
+    solver.SetNumThreads(num_threads)
+    first_stage = vars.num_testers[1:] + [vars.num_handlers[h][a] for h in problem.handler_categories for a in problem.handlers]
+    eliminated = eliminated_expressions(problem, vars) if presolve else {}
+    best_bound = None
+    if checkpoint_path is not None:
+        status, best_bound = solve_with_checkpoints(solver, checkpoint_path, first_stage, time_slice, time_limit, num_threads, derived=eliminated)
+    else:
+        if time_limit is not None:
+            solver.SetTimeLimit(int(time_limit*1000))
+        status = solver.Solve()
+    report = {"status": status, "objective": None, "best_bound": None, "portfolio": {}, "eliminated": {}}
+    if status == pywraplp.Solver.OPTIMAL or status == pywraplp.Solver.FEASIBLE:
+        print("Objective =", solver.Objective().Value())
+        report["objective"] = solver.Objective().Value()
+        report["best_bound"] = solver.Objective().BestBound() if best_bound is None else best_bound
+        report["portfolio"] = {var.name(): var.solution_value() for var in first_stage}
+        # presolve substitutes out S, V and F; recover their values here
+        report["eliminated"] = {name: expr.solution_value() for name, expr in eliminated.items()}
+    return report
+
+
+def round_and_repair(problem: RPP,
+                     vars: Variables,
+                     lp_values: List[float]) -> Dict[int, float]:
+    """
+    main_stochastic.round_and_repair for the node model: K is rounded up
+    (never below K0) and every node's X cover the rest of its LP workload
+    from the cheapest channel. y follows the sign of the LP inventory S.
+    """
+    def value(var: pywraplp.LinearExpr) -> float:
+        return evaluate(var, lp_values)
+
+    fixed = {}
+    for m in problem.testers:
+        fixed[vars.num_testers[m].index()] = max(problem.initial_num_testers[(m,)], math.ceil(value(vars.num_testers[m]) - 1e-6))
+    for h in problem.handler_categories:
+        for a in problem.handlers:
+            fixed[vars.num_handlers[h][a].index()] = max(problem.initial_num_handlers[h,a], math.ceil(value(vars.num_handlers[h][a]) - 1e-6))
+
+    for n in problem.nodes:
+        p = problem.node_periods[n]
+        # Constraint (2)
+        for m in problem.testers:
+            total_utilization_rate = problem.tester_work_hours[p, m]*problem.tester_target_utils[p, m]
+            workload = sum(
+                (problem.tester_ablities[m, t] * value(vars.num_produced_main[n][m][t]))/(problem.tester_throughputs[m,t]*total_utilization_rate)
+                for t in problem.products
+            )
+            deficit = max(0, math.ceil(workload - fixed[vars.num_testers[m].index()] - 1e-6))
+            cheapest = min(problem.tester_channels, key=lambda z: problem.tester_borrow_prices[p,m,z])
+            for z in problem.tester_channels:
+                fixed[vars.num_acquired_testers[n][m][z].index()] = deficit if z == cheapest else 0
+
+        # Constraint (4)
+        for a in problem.handlers:
+            for h in problem.handler_categories:
+                total_utilization_rate = problem.handler_work_hours[p,h,a]*problem.handler_target_utils[p,h,a]
+                workload = sum(
+                        (problem.handler_ablities[m,h,a,t]*value(vars.num_produced_by_handler_categories[n][m][h][a][t]))/(problem.handler_throughputs[m,h,a,t]*total_utilization_rate)
+                        for m in problem.testers for t in problem.products
+                    )
+                deficit = max(0, math.ceil(workload - fixed[vars.num_handlers[h][a].index()] - 1e-6))
+                cheapest = min(problem.handler_channels, key=lambda z: problem.handler_borrow_prices[p,h,a,z])
+                for z in problem.handler_channels:
+                    fixed[vars.num_acquired_handlers[n][h][a][z].index()] = deficit if z == cheapest else 0
+
+    for n in range(problem.num_nodes+1):
+        for t in problem.products:
+            fixed[vars.y[n][t].index()] = 1 if value(vars.product_capacity_loading_qtys[n][t]) >= 0 else 0
+    return fixed
+
+
+def solve_heuristic(problem: RPP,
+                    presolve: bool=False,
+                    cache: Optional[ModelCache]=None) -> Dict:
+    if cache is not None:
+        solver, vars = build_model_cached(problem, cache, presolve)
+    else:
+        solver, vars = build_model(problem, presolve)
+    report = solve_lp_and_repair(solver, lambda lp_values: round_and_repair(problem, vars, lp_values))
+    first_stage = vars.num_testers[1:] + [vars.num_handlers[h][a] for h in problem.handler_categories for a in problem.handlers]
+    report["portfolio"] = {var.name(): var.solution_value() for var in first_stage}
+    eliminated = eliminated_expressions(problem, vars) if presolve else {}
+    report["eliminated"] = {name: expr.solution_value() for name, expr in eliminated.items()}
+    print("Objective =", report["objective"])
+    print("LP bound =", report["lp_bound"])
+    print("Gap =", report["gap"])
+    return report
+
+
+def compare_with_path_expansion(problem: RPP, presolve: bool=False) -> Dict:
+    """
+    Size of the node model against main_stochastic.build_model over the
+    tree's root-to-leaf paths, which repeats every shared node once per leaf
+    below it.
+    """
+    solver, _ = build_model(problem, presolve)
+    path_solver, _ = main_stochastic.build_model(problem, presolve)
+    return {
+        "num_nodes": problem.num_nodes,
+        "num_leaves": len(problem.leaves),
+        "node_variables": solver.NumVariables(),
+        "node_constraints": solver.NumConstraints(),
+        "path_variables": path_solver.NumVariables(),
+        "path_constraints": path_solver.NumConstraints(),
+    }
+
+
+def run():
+    problem = RPP(branching=[1, 1, 1, 1, 1, 2, 2, 3],
+                  distribution="uniform",
+                  variance=0.1)
+    for key, value in compare_with_path_expansion(problem).items():
+        print(f"{key:<18s} = {value:,}")
+    solve_heuristic(problem, presolve=True)
+
+if __name__ == "__main__":
+    run()
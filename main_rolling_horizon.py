@@ -0,0 +1,141 @@
+import time
+from typing import Dict, Optional, Tuple
+
+from ortools.linear_solver import pywraplp
+
+from main_deterministic import Variables, build_model
+from problem_deterministic import RPP
+
+
+def solve_window(problem: RPP,
+                 time_limit: Optional[float]=None) -> Tuple[pywraplp.Solver, Variables]:
+    solver, vars = build_model(problem)
+    # windows are small; several multi-threaded SCIP instances built and torn
+    # down in one process have been seen to segfault, so stay single-threaded
+    if time_limit is not None:
+        solver.SetTimeLimit(int(time_limit*1000))
+    status = solver.Solve()
+    if status != pywraplp.Solver.OPTIMAL and status != pywraplp.Solver.FEASIBLE:
+        raise RuntimeError(f"No feasible solution for window of {problem.num_periods} periods, status {status}")
+    return solver, vars
+
+
+def evaluate_objective(problem: RPP,
+                       final_capital: float,
+                       num_testers: Dict,
+                       num_handlers: Dict) -> float:
+    """
+    The objective of build_model for a given final capital and portfolio,
+    measured against the original initial portfolio of `problem`.
+    """
+    compound_interest = 1
+    for p in problem.periods:
+        compound_interest *= (1 + problem.interest_rates[p])
+    tester_purchase_cost = sum((problem.tester_initial_prices[(m,)]- problem.tester_salvage_prices[(m,)])*(num_testers[(m,)]-problem.initial_num_testers[(m,)]) for m in problem.testers)
+    handler_purchase_cost = sum((problem.handler_initial_prices[h,a]-problem.handler_salvage_prices[h,a])*(num_handlers[h,a]-problem.initial_num_handlers[h,a]) for h in problem.handler_categories for a in problem.handlers)
+    return final_capital/compound_interest - tester_purchase_cost - handler_purchase_cost
+
+
+def solve_rolling_horizon(problem: RPP,
+                          window_size: int,
+                          commit_size: int,
+                          time_limit_per_window: Optional[float]=None) -> Dict:
+    """
+    Solve `problem` as a sequence of overlapping windows of `window_size`
+    periods, keeping the decisions of the first `commit_size` periods of each
+    window (all of them for the last window).
+
+    The next window starts right after the committed periods, from the
+    committed inventory S and capital F in place of S0 and F0. The portfolio
+    K bought so far becomes the next window's K0, so later windows may only
+    add to it and pay for the increment.
+
+    Returns
+    -------
+    dict
+        The stitched plan: capitals[p], inventory[p,t],
+        acquired_testers[p,m,z], acquired_handlers[p,h,a,z], the final
+        num_testers/num_handlers and the stitched objective.
+    """
+    if not 1 <= commit_size <= window_size:
+        raise ValueError(f"Need 1 <= commit_size <= window_size, got {commit_size} and {window_size}")
+    inventory = problem.initial_capacity_loading_qty
+    capital = problem.capital
+    num_testers = problem.initial_num_testers
+    num_handlers = problem.initial_num_handlers
+    plan = {
+        "capitals": {0: capital},
+        "inventory": {},
+        "acquired_testers": {},
+        "acquired_handlers": {},
+    }
+    first_period = min(problem.periods)
+    last_period = max(problem.periods)
+    while first_period <= last_period:
+        window_last = min(first_period + window_size - 1, last_period)
+        commit_last = window_last if window_last == last_period else first_period + commit_size - 1
+        sub_problem = problem.window(first_period, window_last, inventory, capital, num_testers, num_handlers)
+        solver, vars = solve_window(sub_problem, time_limit_per_window)
+        for p in range(first_period, commit_last+1):
+            i = p - first_period + 1
+            plan["capitals"][p] = vars.capitals[i].solution_value()
+            for t in problem.products:
+                plan["inventory"][p,t] = vars.product_capacity_loading_qtys[i][t].solution_value()
+            for m in problem.testers:
+                for z in problem.tester_channels:
+                    plan["acquired_testers"][p,m,z] = round(vars.num_acquired_testers[i][m][z].solution_value())
+            for h in problem.handler_categories:
+                for a in problem.handlers:
+                    for z in problem.handler_channels:
+                        plan["acquired_handlers"][p,h,a,z] = round(vars.num_acquired_handlers[i][h][a][z].solution_value())
+        inventory = {(t,): plan["inventory"][commit_last,t] for t in problem.products}
+        capital = plan["capitals"][commit_last]
+        num_testers = {(m,): round(vars.num_testers[m].solution_value()) for m in problem.testers}
+        num_handlers = {(h,a): round(vars.num_handlers[h][a].solution_value()) for h in problem.handler_categories for a in problem.handlers}
+        first_period = commit_last + 1
+
+    plan["num_testers"] = num_testers
+    plan["num_handlers"] = num_handlers
+    plan["objective"] = evaluate_objective(problem, capital, num_testers, num_handlers)
+    return plan
+
+
+def compare_with_monolithic(problem: RPP,
+                            window_size: int,
+                            commit_size: int,
+                            time_limit_per_window: Optional[float]=None,
+                            time_limit: Optional[float]=None) -> Dict:
+    """
+    Solve `problem` both rolling-horizon and as one model and report how far
+    the stitched objective falls below the monolithic one.
+    """
+    start = time.time()
+    plan = solve_rolling_horizon(problem, window_size, commit_size, time_limit_per_window)
+    rolling_horizon_time = time.time() - start
+
+    start = time.time()
+    solver, _ = solve_window(problem, time_limit)
+    monolithic_time = time.time() - start
+    monolithic_objective = solver.Objective().Value()
+
+    return {
+        "stitched_objective": plan["objective"],
+        "monolithic_objective": monolithic_objective,
+        "gap": (monolithic_objective - plan["objective"])/abs(monolithic_objective),
+        "rolling_horizon_time": rolling_horizon_time,
+        "monolithic_time": monolithic_time,
+    }
+
+
+def run():
+    problem = RPP()
+    report = compare_with_monolithic(problem,
+                                     window_size=4,
+                                     commit_size=2,
+                                     time_limit_per_window=30,
+                                     time_limit=300)
+    for key, value in report.items():
+        print(f"{key:<24s} = {value:,.6f}")
+
+if __name__ == "__main__":
+    run()
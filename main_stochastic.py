@@ -1,7 +1,13 @@
-from typing import List
+import math
+from typing import Dict, List, Optional, Tuple
 
 from ortools.linear_solver import pywraplp
+
+from checkpoint import evaluate, solve_with_checkpoints
+from lp_heuristic import solve_lp_and_repair
+from model_cache import ModelCache
 from problem_stochastic import RPP
+from scenario_store import ScenarioStore
 
 
 def nested_shape(lst):
@@ -16,11 +22,9 @@ def nested_shape(lst):
 class Variables:
     def __init__(self, 
                  solver: pywraplp.Solver,
-                 problem: RPP):
-        self.capitals = [
-            [solver.NumVar(-solver.infinity(), solver.infinity(), f"F^{scenario}_{period}") for period in range(problem.num_periods+1)]
-            for scenario in range(problem.num_scenarios)
-        ]
+                 problem: RPP,
+                 presolve: bool=False):
+        # first-stage portfolio, shared by all scenarios
         # num_testers[m]
         self.num_testers = [None]+[solver.IntVar(problem.initial_num_testers[(m,)], solver.infinity(), f"K_({m})") for m in range(1, problem.num_testers+1)]
         # num_handlers[h][a]
@@ -28,191 +32,459 @@ class Variables:
                 [None] + [solver.IntVar(problem.initial_num_handlers[(h, a)], solver.infinity(), f"K^{h}_{a}") for a in range(1, problem.num_handlers+1)]
                 for h in range(1, problem.num_handler_categories+1)
             ]
-        # num_acquired_testers[p][m][z]
-        self.num_acquired_testers = [
+        # recourse, one copy per scenario
+        # capitals[s][p]
+        if not presolve:
+            self.capitals = [None] + [
+                [solver.NumVar(-solver.infinity(), solver.infinity(), f"F^{s}_{period}") for period in range(problem.num_periods+1)]
+                for s in problem.scenarios
+            ]
+        # num_acquired_testers[s][p][m][z]
+        self.num_acquired_testers = [None] + [
             [
-                [solver.IntVar(0, solver.infinity(), f"X_({p},{m},{z})") for z in range(problem.num_tester_channels+1)]
-                for m in range(problem.num_testers+1)
+                [
+                    [solver.IntVar(0, solver.infinity(), f"X_({s},{p},{m},{z})") for z in range(problem.num_tester_channels+1)]
+                    for m in range(problem.num_testers+1)
+                ]
+                for p in range(problem.num_periods+1)
             ]
-            for p in range(problem.num_periods+1)
+            for s in problem.scenarios
         ]
-        # num_acquired_handlers[p][h][a][z]
-        self.num_acquired_handlers = [
+        # num_acquired_handlers[s][p][h][a][z]
+        self.num_acquired_handlers = [None] + [
             [
                 [
-                    [solver.IntVar(0, solver.infinity(), f"X^{h}_({p},{a},{z})") for z in range(problem.num_handler_channels+1)]
-                    for a in range(problem.num_handlers+1)
+                    [
+                        [solver.IntVar(0, solver.infinity(), f"X^{h}_({s},{p},{a},{z})") for z in range(problem.num_handler_channels+1)]
+                        for a in range(problem.num_handlers+1)
+                    ]
+                    for h in range(problem.num_handler_categories+1)
                 ]
-                for h in range(problem.num_handler_categories+1)
+                for p in range(problem.num_periods+1)
             ]
-            for p in range(problem.num_periods+1)
+            for s in problem.scenarios
         ]
-        # num_produced_main[p][m][t]
-        self.num_produced_main = [
+        # num_produced_main[s][p][m][t]
+        self.num_produced_main = [None] + [
             [
-                [solver.NumVar(0, solver.infinity(), f"Q_({p},{m},{t})") for t in range(problem.num_products+1)]
-                for m in range(problem.num_testers+1)
+                [
+                    [solver.NumVar(0, solver.infinity(), f"Q_({s},{p},{m},{t})") for t in range(problem.num_products+1)]
+                    for m in range(problem.num_testers+1)
+                ]
+                for p in range(problem.num_periods+1)
             ]
-            for p in range(problem.num_periods+1)
+            for s in problem.scenarios
         ]
-        # num_produced_combined[p][m][h][a][t]
-        self.num_produced_by_handler_categories = [
+        # num_produced_combined[s][p][m][h][a][t]
+        self.num_produced_by_handler_categories = [None] + [
             [
                 [
                     [
-                        [solver.NumVar(0, solver.infinity(), f"Q^{h}_({p},{m},{a},{t})") for t in range(problem.num_products+1)]
-                        for a in range(problem.num_handlers+1)
+                        [
+                            [solver.NumVar(0, solver.infinity(), f"Q^{h}_({s},{p},{m},{a},{t})") for t in range(problem.num_products+1)]
+                            for a in range(problem.num_handlers+1)
+                        ]
+                        for h in range(problem.num_handler_categories+1)
                     ]
-                    for h in range(problem.num_handler_categories+1)
+                    for m in range(problem.num_testers+1)
                 ]
-                for m in range(problem.num_testers+1)
+                for p in range(problem.num_periods+1)
             ]
-            for p in range(problem.num_periods+1)
-        ]
-        #product_capacity_loading_qtys[p][t]
-        self.product_capacity_loading_qtys = [
-            [solver.NumVar(-solver.infinity(), solver.infinity(), f"S_({p},{t})") for t in range(problem.num_products+1)]
-            for p in range(problem.num_periods+1)
-        ]
-        self.Spos = [
-            [solver.NumVar(0, solver.infinity(), f"Spos_({p},{t})") for t in range(problem.num_products+1)]
-            for p in range(problem.num_periods+1)
+            for s in problem.scenarios
         ]
-        self.Sneg = [
-            [solver.NumVar(0, solver.infinity(), f"Sneg_({p},{t})") for t in range(problem.num_products+1)]
-            for p in range(problem.num_periods+1)
+        self.Spos = [None] + [
+            [
+                [solver.NumVar(0, solver.infinity(), f"Spos_({s},{p},{t})") for t in range(problem.num_products+1)]
+                for p in range(problem.num_periods+1)
+            ]
+            for s in problem.scenarios
         ]
-        #product_capacity_loading_costs[p][t]
-        self.product_capacity_loading_costs = [
-            [solver.NumVar(-solver.infinity(), solver.infinity(), f"V_({p},{t})") for t in range(problem.num_products+1)]
-            for p in range(problem.num_periods+1)
+        self.Sneg = [None] + [
+            [
+                [solver.NumVar(0, solver.infinity(), f"Sneg_({s},{p},{t})") for t in range(problem.num_products+1)]
+                for p in range(problem.num_periods+1)
+            ]
+            for s in problem.scenarios
         ]
-        self.y = [
-            [solver.BoolVar(f"y_({p},{t})") for t in range(problem.num_products+1)]
-            for p in range(problem.num_periods+1)
+        if presolve:
+            # S, V and F are only aliases, defined by (5prelude), (7) and (8).
+            # Keep them as expressions so their values can still be read with
+            # solution_value(); build_model fills capitals[s][1:] in (8).
+            self.capitals = [None] + [
+                [problem.capital] + [None]*problem.num_periods
+                for s in problem.scenarios
+            ]
+            self.product_capacity_loading_qtys = [None] + [
+                [
+                    [self.Spos[s][p][t] - self.Sneg[s][p][t] for t in range(problem.num_products+1)]
+                    for p in range(problem.num_periods+1)
+                ]
+                for s in problem.scenarios
+            ]
+            self.product_capacity_loading_costs = [None] + [
+                [[None]*(problem.num_products+1)] + [
+                    [None] + [problem.excess_production_cost[p,t]*self.Spos[s][p][t] + problem.shortage_cost[p,t]*self.Sneg[s][p][t] for t in range(1, problem.num_products+1)]
+                    for p in range(1, problem.num_periods+1)
+                ]
+                for s in problem.scenarios
+            ]
+        else:
+            #product_capacity_loading_qtys[s][p][t]
+            self.product_capacity_loading_qtys = [None] + [
+                [
+                    [solver.NumVar(-solver.infinity(), solver.infinity(), f"S_({s},{p},{t})") for t in range(problem.num_products+1)]
+                    for p in range(problem.num_periods+1)
+                ]
+                for s in problem.scenarios
+            ]
+            #product_capacity_loading_costs[s][p][t]
+            self.product_capacity_loading_costs = [None] + [
+                [
+                    [solver.NumVar(-solver.infinity(), solver.infinity(), f"V_({s},{p},{t})") for t in range(problem.num_products+1)]
+                    for p in range(problem.num_periods+1)
+                ]
+                for s in problem.scenarios
+            ]
+        self.y = [None] + [
+            [
+                [solver.BoolVar(f"y_({s},{p},{t})") for t in range(problem.num_products+1)]
+                for p in range(problem.num_periods+1)
+            ]
+            for s in problem.scenarios
         ]
         self.BigM = 999999999999
         
         
 
 
-def solve(problem: RPP):
+def build_model(problem: RPP, presolve: bool=False) -> Tuple[pywraplp.Solver, Variables]:
     solver: pywraplp.Solver = pywraplp.Solver.CreateSolver("SCIP")
-    vars = Variables(solver, problem)
-    # Constraint (2)
-    for p in problem.periods:
-        for m in problem.testers:
-            # 1️⃣ Available testers in period p, tester type m
-            num_available_testers = (
-                vars.num_testers[m]
-                + sum(vars.num_acquired_testers[p][m][z] for z in problem.tester_channels)
-            )
-
-            # 2️⃣ Effective utilization rate (hours × utilization fraction)
-            total_utilization_rate = (
-                problem.tester_work_hours[p, m]
-                * problem.tester_target_utils[p, m]
-            )
-
-            # 3️⃣ Production workload adjusted by tester ability
-            num_produced_main = sum(
-                (problem.tester_ablities[m, t] * vars.num_produced_main[p][m][t])/(problem.tester_throughputs[m,t]*total_utilization_rate)
-                for t in problem.products
-            )
-
-            # 4️⃣ Capacity constraint
-            solver.Add(
-                num_available_testers >= num_produced_main,
-                f"TesterCapacity[p={p},m={m}]"
-            )
-    
-    # Constraint (3)
-    for p in problem.periods:
-        for m in problem.testers:
-            for h in problem.handler_categories:
-                for t in problem.products:
+    vars = Variables(solver, problem, presolve)
+    for s in problem.scenarios:
+        # Constraint (2)
+        for p in problem.periods:
+            for m in problem.testers:
+                # 1️⃣ Available testers in period p, tester type m
+                num_available_testers = (
+                    vars.num_testers[m]
+                    + sum(vars.num_acquired_testers[s][p][m][z] for z in problem.tester_channels)
+                )
+
+                # 2️⃣ Effective utilization rate (hours × utilization fraction)
+                total_utilization_rate = (
+                    problem.tester_work_hours[p, m]
+                    * problem.tester_target_utils[p, m]
+                )
+
+                # 3️⃣ Production workload adjusted by tester ability
+                num_produced_main = sum(
+                    (problem.tester_ablities[m, t] * vars.num_produced_main[s][p][m][t])/(problem.tester_throughputs[m,t]*total_utilization_rate)
+                    for t in problem.products
+                )
+
+                # 4️⃣ Capacity constraint
+                solver.Add(
+                    num_available_testers >= num_produced_main,
+                    f"TesterCapacity[s={s},p={p},m={m}]"
+                )
+        
+        # Constraint (3)
+        for p in problem.periods:
+            for m in problem.testers:
+                for h in problem.handler_categories:
+                    for t in problem.products:
+                        sum_produced_by_categories = sum(
+                            problem.handler_ablities[m,h,a,t]*vars.num_produced_by_handler_categories[s][p][m][h][a][t]
+                            for a in problem.handlers
+                        )
+                        solver.Add(sum_produced_by_categories == vars.num_produced_main[s][p][m][t])
+        
+        # Constraint (4)
+        for p in problem.periods:
+            for a in problem.handlers:
+                for h in problem.handler_categories:
+                    num_available_handlers = vars.num_handlers[h][a] + sum(vars.num_acquired_handlers[s][p][h][a][z] for z in problem.handler_channels)
+                    total_utilization_rate = problem.handler_work_hours[p,h,a]*problem.handler_target_utils[p,h,a]
                     sum_produced_by_categories = sum(
-                        problem.handler_ablities[m,h,a,t]*vars.num_produced_by_handler_categories[p][m][h][a][t]
-                        for a in problem.handlers
-                    )
-                    solver.Add(sum_produced_by_categories == vars.num_produced_main[p][m][t])
-    
-    # Constraint (4)
-    for p in problem.periods:
-        for a in problem.handlers:
-            for h in problem.handler_categories:
-                num_available_handlers = vars.num_handlers[h][a] + sum(vars.num_acquired_handlers[p][h][a][z] for z in problem.handler_channels)
-                total_utilization_rate = problem.handler_work_hours[p,h,a]*problem.handler_target_utils[p,h,a]
-                sum_produced_by_categories = sum(
-                        (problem.handler_ablities[m,h,a,t]*vars.num_produced_by_handler_categories[p][m][h][a][t])/(problem.handler_throughputs[m,h,a,t]*total_utilization_rate)
-                        for m in problem.testers for t in problem.products
-                    )
-                solver.Add(num_available_handlers >= sum_produced_by_categories)
-    
-    # Constraint (5prelude)
-    for p in range(problem.num_periods+1):
-        for t in problem.products:
-            solver.Add(vars.Spos[p][t] <= vars.BigM * vars.y[p][t])
-            solver.Add(vars.Sneg[p][t] <= vars.BigM * (1 - vars.y[p][t]))
-            solver.Add(vars.product_capacity_loading_qtys[p][t] == vars.Spos[p][t] - vars.Sneg[p][t])
-    for t in problem.products:
-        solver.Add(vars.product_capacity_loading_qtys[0][t] == problem.initial_capacity_loading_qty[(t,)])
-    # Constraint (5)
-    for p in problem.periods:
-        for t in problem.products:
-            num_produced_main = sum(
-                (problem.tester_ablities[m, t] * vars.num_produced_main[p][m][t])
-                for m in problem.testers
-            )
-            solver.Add(vars.product_capacity_loading_qtys[p][t] == vars.product_capacity_loading_qtys[p-1][t] + num_produced_main - problem.demands_mts[p,t]) 
-    
-    # Constraint (6)
-    for p in problem.periods:
+                            (problem.handler_ablities[m,h,a,t]*vars.num_produced_by_handler_categories[s][p][m][h][a][t])/(problem.handler_throughputs[m,h,a,t]*total_utilization_rate)
+                            for m in problem.testers for t in problem.products
+                        )
+                    solver.Add(num_available_handlers >= sum_produced_by_categories)
+        
+        # Constraint (5prelude)
+        for p in range(problem.num_periods+1):
+            for t in problem.products:
+                solver.Add(vars.Spos[s][p][t] <= vars.BigM * vars.y[s][p][t])
+                solver.Add(vars.Sneg[s][p][t] <= vars.BigM * (1 - vars.y[s][p][t]))
+                if not presolve:
+                    solver.Add(vars.product_capacity_loading_qtys[s][p][t] == vars.Spos[s][p][t] - vars.Sneg[s][p][t])
         for t in problem.products:
-            num_produced_main = sum(
-                (problem.tester_ablities[m, t] * vars.num_produced_main[p][m][t])
-                for m in problem.testers
-            )
-            solver.Add(num_produced_main <= problem.demands_mto[p,t])
+            solver.Add(vars.product_capacity_loading_qtys[s][0][t] == problem.initial_capacity_loading_qty[(t,)])
+        # Constraint (5)
+        for p in problem.periods:
+            for t in problem.products:
+                num_produced_main = sum(
+                    (problem.tester_ablities[m, t] * vars.num_produced_main[s][p][m][t])
+                    for m in problem.testers
+                )
+                solver.Add(vars.product_capacity_loading_qtys[s][p][t] == vars.product_capacity_loading_qtys[s][p-1][t] + num_produced_main - problem.demands_mts[s,p,t]) 
+        
+        # Constraint (6)
+        for p in problem.periods:
+            for t in problem.products:
+                num_produced_main = sum(
+                    (problem.tester_ablities[m, t] * vars.num_produced_main[s][p][m][t])
+                    for m in problem.testers
+                )
+                solver.Add(num_produced_main <= problem.demands_mto[s,p,t])
 
-    # Constraint (7)
-    for p in problem.periods:
-        for t in problem.products:
-            excess_cost = problem.excess_production_cost[p,t]*vars.Spos[p][t]
-            shortage_cost = problem.shortage_cost[p,t]*vars.Sneg[p][t]
-            solver.Add(vars.product_capacity_loading_costs[p][t] == excess_cost + shortage_cost)
+        # Constraint (7)
+        if not presolve:
+            for p in problem.periods:
+                for t in problem.products:
+                    excess_cost = problem.excess_production_cost[p,t]*vars.Spos[s][p][t]
+                    shortage_cost = problem.shortage_cost[p,t]*vars.Sneg[s][p][t]
+                    solver.Add(vars.product_capacity_loading_costs[s][p][t] == excess_cost + shortage_cost)
 
-    # Constraint (8prelude)
-    solver.Add(vars.capitals[0] == problem.capital)
-    # Constraint (8)
-    for p in problem.periods:
-        tester_borrow_total_cost = sum(problem.tester_borrow_prices[p,m,z]*vars.num_acquired_testers[p][m][z] for m in problem.testers for z in problem.tester_channels)
-        handler_borrow_total_cost = sum(problem.handler_borrow_prices[p,h,a,z]*vars.num_acquired_handlers[p][h][a][z] for z in problem.handler_channels for a in problem.handlers for h in problem.handler_categories)
-        inventory_cost = sum(vars.product_capacity_loading_costs[p][t] for t in problem.products)
-        total_profit_mts = sum(problem.product_profits[p,t]*problem.demands_mts[p,t] for t in problem.products)
-        total_profit_mto = sum(problem.product_profits[p,t]*vars.num_produced_main[p][m][t] for t in problem.products for m in problem.testers)
-        last_capital = vars.capitals[p-1]*(1+problem.interest_rates[p])
-        solver.Add(vars.capitals[p] == last_capital - tester_borrow_total_cost - handler_borrow_total_cost - inventory_cost + total_profit_mts + total_profit_mto)
-
-    # Objective
+        # Constraint (8prelude)
+        if not presolve:
+            solver.Add(vars.capitals[s][0] == problem.capital)
+        # Constraint (8)
+        for p in problem.periods:
+            tester_borrow_total_cost = sum(problem.tester_borrow_prices[p,m,z]*vars.num_acquired_testers[s][p][m][z] for m in problem.testers for z in problem.tester_channels)
+            handler_borrow_total_cost = sum(problem.handler_borrow_prices[p,h,a,z]*vars.num_acquired_handlers[s][p][h][a][z] for z in problem.handler_channels for a in problem.handlers for h in problem.handler_categories)
+            inventory_cost = sum(vars.product_capacity_loading_costs[s][p][t] for t in problem.products)
+            total_profit_mts = sum(problem.product_profits[p,t]*problem.demands_mts[s,p,t] for t in problem.products)
+            total_profit_mto = sum(problem.product_profits[p,t]*problem.tester_ablities[m, t]*vars.num_produced_main[s][p][m][t] for t in problem.products for m in problem.testers)
+            last_capital = vars.capitals[s][p-1]*(1+problem.interest_rates[p])
+            capital = last_capital - tester_borrow_total_cost - handler_borrow_total_cost - inventory_cost + total_profit_mts + total_profit_mto
+            if presolve:
+                # unrolled, F_T is F0 and every period's cash flow compounded to T
+                vars.capitals[s][p] = capital
+            else:
+                solver.Add(vars.capitals[s][p] == capital)
+
+    # Objective: expected discounted final capital over the sampled scenarios
     last_period = max(problem.periods)
     compound_interest = 1
     for p in problem.periods:
         compound_interest *= (1 + problem.interest_rates[p])
-    last_capital = vars.capitals[last_period]/compound_interest
+    last_capital = sum(vars.capitals[s][last_period] for s in problem.scenarios)/(compound_interest*problem.num_scenarios)
     tester_purchase_cost = sum((problem.tester_initial_prices[(m,)]- problem.tester_salvage_prices[(m,)])*(vars.num_testers[m]-problem.initial_num_testers[(m,)]) for m in problem.testers)
     handler_purchase_cost = sum((problem.handler_initial_prices[h,a]-problem.handler_salvage_prices[h,a])*(vars.num_handlers[h][a]-problem.initial_num_handlers[h,a]) for h in problem.handler_categories for a in problem.handlers)
     obj = last_capital - tester_purchase_cost - handler_purchase_cost
     solver.Maximize(obj)
-    solver.SetNumThreads(16)
-    status = solver.Solve()
+    return solver, vars
+
+
+def build_model_cached(problem: RPP,
+                       cache: ModelCache,
+                       presolve: bool=False) -> Tuple[pywraplp.Solver, Variables]:
+    key = cache.key(problem, build_model, presolve=presolve)
+    cached = cache.load(key, Variables)
+    if cached is not None:
+        return cached
+    solver, vars = build_model(problem, presolve)
+    cache.store(key, solver, vars)
+    return solver, vars
+
+
+def eliminated_expressions(problem: RPP, vars: Variables) -> Dict[str, pywraplp.LinearExpr]:
+    """
+    S, V and F of a presolved model, which exist only as expressions, under
+    the names the variables carry without presolve.
+    """
+    expressions = {}
+    for s in problem.scenarios:
+        for p in range(problem.num_periods+1):
+            for t in problem.products:
+                expressions[f"S_({s},{p},{t})"] = vars.product_capacity_loading_qtys[s][p][t]
+        for p in problem.periods:
+            for t in problem.products:
+                expressions[f"V_({s},{p},{t})"] = vars.product_capacity_loading_costs[s][p][t]
+            expressions[f"F^{s}_{p}"] = vars.capitals[s][p]
+    return expressions
+
+
+def solve(problem: RPP,
+          checkpoint_path: Optional[str]=None,
+          time_slice: float=60,
+          time_limit: Optional[float]=None,
+          presolve: bool=False,
+          cache: Optional[ModelCache]=None,
+          num_threads: int=16) -> Dict:
+    if cache is not None:
+        solver, vars = build_model_cached(problem, cache, presolve)
+    else:
+        solver, vars = build_model(problem, presolve)
+    solver.SetNumThreads(num_threads)
+    first_stage = vars.num_testers[1:] + [vars.num_handlers[h][a] for h in problem.handler_categories for a in problem.handlers]
+    eliminated = eliminated_expressions(problem, vars) if presolve else {}
+    best_bound = None
+    if checkpoint_path is not None:
+        status, best_bound = solve_with_checkpoints(solver, checkpoint_path, first_stage, time_slice, time_limit, num_threads, derived=eliminated)
+    else:
+        if time_limit is not None:
+            solver.SetTimeLimit(int(time_limit*1000))
+        status = solver.Solve()
+    report = {"status": status, "objective": None, "best_bound": None, "portfolio": {}, "eliminated": {}}
     if status == pywraplp.Solver.OPTIMAL or status == pywraplp.Solver.FEASIBLE:
         print("Objective =", solver.Objective().Value())
+        report["objective"] = solver.Objective().Value()
+        report["best_bound"] = solver.Objective().BestBound() if best_bound is None else best_bound
+        report["portfolio"] = {var.name(): var.solution_value() for var in first_stage}
+        # presolve substitutes out S, V and F; recover their values here
+        report["eliminated"] = {name: expr.solution_value() for name, expr in eliminated.items()}
     # print(status)
     # for var in solver.variables():
     #     val = var.solution_value()
     #     # if abs(val) > 1e-6:   # print only non-zero variables (optional)
     #     print(f"{var.name():<30s} = {val:,.6f}")
+    return report
+
+
+def round_and_repair(problem: RPP,
+                     vars: Variables,
+                     lp_values: List[float]) -> Dict[int, float]:
+    """
+    Integer values for the LP-relaxation-plus-repair heuristic, keyed by
+    variable index. The shared portfolio K is rounded up (never below K0);
+    in every scenario the borrowed X then cover whatever is left of the LP's
+    tester (2) and handler (4) workload, greedily from the cheapest channel.
+    y follows the sign of the LP inventory S.
+    """
+    def value(var: pywraplp.LinearExpr) -> float:
+        return evaluate(var, lp_values)
+
+    fixed = {}
+    for m in problem.testers:
+        fixed[vars.num_testers[m].index()] = max(problem.initial_num_testers[(m,)], math.ceil(value(vars.num_testers[m]) - 1e-6))
+    for h in problem.handler_categories:
+        for a in problem.handlers:
+            fixed[vars.num_handlers[h][a].index()] = max(problem.initial_num_handlers[h,a], math.ceil(value(vars.num_handlers[h][a]) - 1e-6))
+
+    for s in problem.scenarios:
+        # Constraint (2)
+        for p in problem.periods:
+            for m in problem.testers:
+                total_utilization_rate = problem.tester_work_hours[p, m]*problem.tester_target_utils[p, m]
+                workload = sum(
+                    (problem.tester_ablities[m, t] * value(vars.num_produced_main[s][p][m][t]))/(problem.tester_throughputs[m,t]*total_utilization_rate)
+                    for t in problem.products
+                )
+                deficit = max(0, math.ceil(workload - fixed[vars.num_testers[m].index()] - 1e-6))
+                cheapest = min(problem.tester_channels, key=lambda z: problem.tester_borrow_prices[p,m,z])
+                for z in problem.tester_channels:
+                    fixed[vars.num_acquired_testers[s][p][m][z].index()] = deficit if z == cheapest else 0
+
+        # Constraint (4)
+        for p in problem.periods:
+            for a in problem.handlers:
+                for h in problem.handler_categories:
+                    total_utilization_rate = problem.handler_work_hours[p,h,a]*problem.handler_target_utils[p,h,a]
+                    workload = sum(
+                            (problem.handler_ablities[m,h,a,t]*value(vars.num_produced_by_handler_categories[s][p][m][h][a][t]))/(problem.handler_throughputs[m,h,a,t]*total_utilization_rate)
+                            for m in problem.testers for t in problem.products
+                        )
+                    deficit = max(0, math.ceil(workload - fixed[vars.num_handlers[h][a].index()] - 1e-6))
+                    cheapest = min(problem.handler_channels, key=lambda z: problem.handler_borrow_prices[p,h,a,z])
+                    for z in problem.handler_channels:
+                        fixed[vars.num_acquired_handlers[s][p][h][a][z].index()] = deficit if z == cheapest else 0
+
+        for p in range(problem.num_periods+1):
+            for t in problem.products:
+                fixed[vars.y[s][p][t].index()] = 1 if value(vars.product_capacity_loading_qtys[s][p][t]) >= 0 else 0
+    return fixed
+
+
+def solve_heuristic(problem: RPP,
+                    presolve: bool=False,
+                    cache: Optional[ModelCache]=None) -> Dict:
+    if cache is not None:
+        solver, vars = build_model_cached(problem, cache, presolve)
+    else:
+        solver, vars = build_model(problem, presolve)
+    report = solve_lp_and_repair(solver, lambda lp_values: round_and_repair(problem, vars, lp_values))
+    first_stage = vars.num_testers[1:] + [vars.num_handlers[h][a] for h in problem.handler_categories for a in problem.handlers]
+    report["portfolio"] = {var.name(): var.solution_value() for var in first_stage}
+    eliminated = eliminated_expressions(problem, vars) if presolve else {}
+    report["eliminated"] = {name: expr.solution_value() for name, expr in eliminated.items()}
+    print("Objective =", report["objective"])
+    print("LP bound =", report["lp_bound"])
+    print("Gap =", report["gap"])
+    return report
+
+def evaluate_portfolio(problem: RPP,
+                       portfolio: Dict[str, float],
+                       store: ScenarioStore,
+                       batch_size: int=10,
+                       mode: str="heuristic",
+                       presolve: bool=True,
+                       time_limit: Optional[float]=None) -> Dict:
+    """
+    Out-of-sample value of a first-stage portfolio, e.g. the `portfolio` of a
+    solve() or solve_heuristic() report. The store is streamed batch by
+    batch; each batch is built as its own model with K fixed to the
+    portfolio and the recourse re-optimised, so memory does not grow with
+    the size of the store. `mode` "heuristic" re-optimises with the
+    LP-relaxation-plus-repair heuristic (a slight underestimate, fast enough
+    for large stores), "exact" with SCIP. With K fixed the scenarios are
+    independent, so "exact" solves every scenario as its own model with
+    `time_limit` each and ignores `batch_size`; a large batch MILP stopped
+    by its time limit would understate every scenario in it.
+
+    Returns
+    -------
+    dict
+        objective (mean over the store's scenarios), std_error,
+        num_scenarios and num_time_limited, the number of scenarios whose
+        exact recourse was not proven optimal (their values are lower
+        bounds).
+    """
+    if mode not in ("exact", "heuristic"):
+        raise ValueError(f"Unknown mode: {mode}")
+    # counts from a checkpoint or LP-based solve can be off by rounding noise
+    portfolio = {name: round(value) for name, value in portfolio.items()}
+    compound_interest = 1
+    for p in problem.periods:
+        compound_interest *= (1 + problem.interest_rates[p])
+    last_period = max(problem.periods)
+    # the same in every scenario, so it shifts the mean but not the spread
+    tester_purchase_cost = sum((problem.tester_initial_prices[(m,)]- problem.tester_salvage_prices[(m,)])*(portfolio[f"K_({m})"]-problem.initial_num_testers[(m,)]) for m in problem.testers)
+    handler_purchase_cost = sum((problem.handler_initial_prices[h,a]-problem.handler_salvage_prices[h,a])*(portfolio[f"K^{h}_{a}"]-problem.initial_num_handlers[h,a]) for h in problem.handler_categories for a in problem.handlers)
+    purchase_cost = tester_purchase_cost + handler_purchase_cost
+    total = 0.
+    total_squares = 0.
+    num_time_limited = 0
+    for _, demands_mts, demands_mto in store.batches(batch_size if mode == "heuristic" else 1):
+        batch = problem.with_scenarios(demands_mts, demands_mto)
+        solver, vars = build_model(batch, presolve)
+        first_stage = vars.num_testers[1:] + [vars.num_handlers[h][a] for h in problem.handler_categories for a in problem.handlers]
+        for var in first_stage:
+            var.SetBounds(portfolio[var.name()], portfolio[var.name()])
+        if mode == "heuristic":
+            solve_lp_and_repair(solver, lambda lp_values: round_and_repair(batch, vars, lp_values))
+        else:
+            # one solver per scenario; stay single-threaded as in the rolling horizon
+            if time_limit is not None:
+                solver.SetTimeLimit(int(time_limit*1000))
+            status = solver.Solve()
+            if status != pywraplp.Solver.OPTIMAL and status != pywraplp.Solver.FEASIBLE:
+                raise RuntimeError(f"No feasible recourse for a scenario, status {status}")
+            if status == pywraplp.Solver.FEASIBLE:
+                num_time_limited += 1
+        for s in batch.scenarios:
+            value = vars.capitals[s][last_period].solution_value()/compound_interest - purchase_cost
+            total += value
+            total_squares += value**2
+    mean = total/len(store)
+    variance = max(0., total_squares/len(store) - mean**2)
+    return {
+        "objective": mean,
+        "std_error": math.sqrt(variance/len(store)),
+        "num_scenarios": len(store),
+        "num_time_limited": num_time_limited,
+    }
 
 def run():
     problem = RPP(num_scenarios=10, #tambahin jadi berapa gitu, 10?
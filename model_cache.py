@@ -0,0 +1,156 @@
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+import tempfile
+import warnings
+from typing import Any, Callable, Optional, Tuple, Type, Union
+
+import pandas as pd
+from ortools.linear_solver import linear_solver_pb2, pywraplp
+
+
+def encode_variables(value: Any) -> Any:
+    """
+    JSON-friendly copy of a (nested list of) model variables: variables become
+    {"var": index}, linear expressions {"coeffs": [[index, coeff], ...],
+    "offset": constant}, everything else (None, numbers) is kept as is.
+    """
+    if isinstance(value, list):
+        return [encode_variables(v) for v in value]
+    if isinstance(value, pywraplp.Variable):
+        return {"var": value.index()}
+    if isinstance(value, pywraplp.LinearExpr):
+        coeffs = []
+        offset = 0.
+        for var, coeff in value.GetCoeffs().items():
+            if isinstance(var, pywraplp.Variable):
+                coeffs.append([var.index(), coeff])
+            else:
+                offset += coeff
+        return {"coeffs": coeffs, "offset": offset}
+    return value
+
+
+def decode_variables(value: Any, solver: pywraplp.Solver) -> Any:
+    if isinstance(value, list):
+        return [decode_variables(v, solver) for v in value]
+    if isinstance(value, dict) and "var" in value:
+        return solver.variable(value["var"])
+    if isinstance(value, dict) and "coeffs" in value:
+        return solver.Sum([coeff*solver.variable(index) for index, coeff in value["coeffs"]]) + value["offset"]
+    return value
+
+
+class ModelCache:
+    """
+    On-disk cache of built models.
+
+    Every entry is the model proto (`<key>.pb`), the map from Variables
+    attributes to variable indices (`<key>.json`) and, unless disabled, the
+    same model as free-format MPS (`<key>.mps`) for offline solver tuning.
+    Entries are evicted least recently used first once the directory grows
+    beyond `max_bytes`.
+    """
+    def __init__(self,
+                 cache_dir: Union[str, pathlib.Path]="model-cache",
+                 max_bytes: int=1 << 30,
+                 export_mps: bool=True):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.export_mps = export_mps
+
+    def key(self, problem, build_model: Callable, **flags) -> str:
+        """
+        sha256 over the problem's model-facing data (every attribute except the
+        raw DataFrames, so the scenario seed and sampled demands are included),
+        the formulation flags and the source of the module defining
+        `build_model`, so editing the formulation invalidates old entries.
+        """
+        digest = hashlib.sha256()
+        digest.update(inspect.getsource(inspect.getmodule(build_model)).encode())
+        for name, value in sorted(vars(problem).items()):
+            if isinstance(value, pd.DataFrame):
+                continue
+            if isinstance(value, dict):
+                value = sorted(value.items())
+            digest.update(f"{name}={value!r};".encode())
+        digest.update(repr(sorted(flags.items())).encode())
+        return digest.hexdigest()
+
+    def load(self, key: str, variables_cls: Type) -> Optional[Tuple[pywraplp.Solver, Any]]:
+        model_filepath = self.cache_dir/f"{key}.pb"
+        variables_filepath = self.cache_dir/f"{key}.json"
+        # the json is written last, so its presence marks a complete entry
+        if not variables_filepath.exists() or not model_filepath.exists():
+            return None
+        try:
+            model_bytes = model_filepath.read_bytes()
+            with open(variables_filepath, mode="r", encoding="utf-8") as f:
+                encoded = json.load(f)
+            for filepath in self.entry_files(key):
+                os.utime(filepath)
+        except FileNotFoundError:
+            # evicted by another process since the check above
+            return None
+        model_proto = linear_solver_pb2.MPModelProto()
+        model_proto.ParseFromString(model_bytes)
+        solver: pywraplp.Solver = pywraplp.Solver.CreateSolver("SCIP")
+        error = solver.LoadModelFromProtoKeepNames(model_proto)
+        if error:
+            raise RuntimeError(f"Cannot load cached model {key}: {error}")
+        variables = variables_cls.__new__(variables_cls)
+        for name, value in encoded.items():
+            setattr(variables, name, decode_variables(value, solver))
+        return solver, variables
+
+    def store(self, key: str, solver: pywraplp.Solver, variables: Any):
+        model_proto = linear_solver_pb2.MPModelProto()
+        solver.ExportModelToProto(model_proto)
+        self.write(self.cache_dir/f"{key}.pb", model_proto.SerializeToString())
+        if self.export_mps:
+            self.write(self.cache_dir/f"{key}.mps", solver.ExportModelAsMpsFormat(False, False).encode())
+        encoded = {name: encode_variables(value) for name, value in vars(variables).items()}
+        self.write(self.cache_dir/f"{key}.json", json.dumps(encoded).encode())
+        self.evict(keep=key)
+
+    def write(self, filepath: pathlib.Path, data: bytes):
+        # a unique temporary file, so processes storing the same key at
+        # once never publish each other's partial writes
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=filepath.name + ".", suffix=".tmp", delete=False) as f:
+            f.write(data)
+        os.replace(f.name, filepath)
+
+    def entry_files(self, key: str):
+        return [filepath for filepath in self.cache_dir.glob(f"{key}.*") if filepath.suffix != ".tmp"]
+
+    def evict(self, keep: Optional[str]=None):
+        """
+        Delete least recently used entries until the cache fits `max_bytes`.
+        The entry `keep` (the one just stored) is never deleted; if it alone
+        exceeds `max_bytes` the cache stays over budget and a warning says so.
+        """
+        entries = {}
+        for filepath in self.cache_dir.iterdir():
+            if filepath.suffix == ".tmp":
+                continue
+            try:
+                stat = filepath.stat()
+            except FileNotFoundError:
+                # deleted by another process evicting at the same time
+                continue
+            size, last_used = entries.get(filepath.stem, (0, 0.))
+            entries[filepath.stem] = (size + stat.st_size, max(last_used, stat.st_mtime))
+        total_size = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total_size <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for filepath in self.entry_files(key):
+                filepath.unlink(missing_ok=True)
+            total_size -= size
+        if keep in entries and entries[keep][0] > self.max_bytes:
+            warnings.warn(f"Model cache entry {keep} alone takes {entries[keep][0]} bytes, more than max_bytes={self.max_bytes}")
@@ -1,3 +1,4 @@
+import copy
 import pathlib
 import re
 from typing import Dict, List, Union
@@ -43,9 +44,26 @@ def df_to_multikey_dict(df: pd.DataFrame,
             result[key_tuple] = {v: row[v] for v in values}
     return result
 
+def select_periods(period_keyed: Dict, renumber: Dict[int, int]) -> Dict:
+    """
+    Restrict a period-keyed dict to the periods in `renumber` and relabel them.
+
+    Keys are either the period itself or tuples whose first entry is the period,
+    which covers every period-indexed parameter of RPP.
+    """
+    result = {}
+    for key, value in period_keyed.items():
+        if isinstance(key, tuple):
+            if key[0] in renumber:
+                result[(renumber[key[0]],)+key[1:]] = value
+        elif key in renumber:
+            result[renumber[key]] = value
+    return result
+
+
 class RPP:
-    def __init__(self):
-        data_dir = pathlib.Path("clean-data")
+    def __init__(self, data_dir: Union[str, pathlib.Path]="clean-data"):
+        data_dir = pathlib.Path(data_dir)
         self.data_dir = data_dir
         self.handler_initial_prices_df = pd.read_csv(data_dir/"handler_initial_price.csv")
         self.handler_borrow_prices_df = pd.read_csv(data_dir/"handler_borrow_price.csv")
@@ -175,4 +193,34 @@ class RPP:
             self.tester_work_hours = df_to_multikey_dict(self.tester_work_hours_df, ["p","m"], "workhours")
             workhour_dict_list = [{"a":a, "h":h, "p":p, "workhours":workhours} for a in self.handlers for h in self.handler_categories for p in self.periods]
             self.handler_work_hours_df = pd.DataFrame(workhour_dict_list)
-            self.handler_work_hours = df_to_multikey_dict(self.handler_work_hours_df, ["p","h","a"], "workhours")
\ No newline at end of file
+            self.handler_work_hours = df_to_multikey_dict(self.handler_work_hours_df, ["p","h","a"], "workhours")
+
+    def window(self,
+               first_period: int,
+               last_period: int,
+               initial_capacity_loading_qty: Dict,
+               capital: float,
+               initial_num_testers: Dict,
+               initial_num_handlers: Dict) -> "RPP":
+        """
+        Sub-instance covering periods `first_period`..`last_period`,
+        renumbered to start at 1, that starts from the given state instead of
+        the original S0, F0 and K0. Used by the rolling-horizon solver to pass
+        end-of-window inventory, capital and portfolio forward.
+
+        Only the dicts read by the model are restricted; the `*_df` frames keep
+        the full horizon.
+        """
+        renumber = {p: i+1 for i, p in enumerate(range(first_period, last_period+1))}
+        sub_problem = copy.copy(self)
+        sub_problem.periods = list(renumber.values())
+        sub_problem.num_periods = len(sub_problem.periods)
+        for name in ["demands_mts", "demands_mto", "handler_borrow_prices", "tester_borrow_prices",
+                     "product_profits", "excess_production_cost", "shortage_cost", "interest_rates",
+                     "handler_target_utils", "tester_target_utils", "handler_work_hours", "tester_work_hours"]:
+            setattr(sub_problem, name, select_periods(getattr(self, name), renumber))
+        sub_problem.initial_capacity_loading_qty = initial_capacity_loading_qty
+        sub_problem.capital = capital
+        sub_problem.initial_num_testers = initial_num_testers
+        sub_problem.initial_num_handlers = initial_num_handlers
+        return sub_problem
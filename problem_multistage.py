@@ -0,0 +1,85 @@
+import math
+import pathlib
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+import problem_stochastic
+from problem_stochastic import draw_demands
+
+
+class RPP(problem_stochastic.RPP):
+    """
+    Stochastic RPP whose demands form a scenario tree instead of independent
+    paths.
+
+    `branching[p-1]` is the number of demand outcomes in period p for every
+    node of period p-1, so period p has prod(branching[:p]) nodes. Node 0 is
+    the root (the here-and-now portfolio decision, state S0 and F0); nodes
+    1..num_nodes are numbered period by period. Every node draws its own MTS
+    and MTO demand for each product.
+
+    The tree is exposed as nodes, node_periods[n], node_parents[n],
+    node_probabilities[n] and node_demands_mts/node_demands_mto[n,t]. The
+    inherited per-scenario view (scenarios, demands_mts[s,p,t], ...) holds
+    one scenario per leaf, its root-to-leaf path, so main_stochastic builds
+    the equivalent per-path model of the same tree.
+    """
+    def __init__(self,
+                 branching: List[int],
+                 distribution: str="uniform",
+                 variance: float=0.1,
+                 seed: Optional[int]=None,
+                 data_dir: Union[str, pathlib.Path]="clean-data"):
+        self.branching = list(branching)
+        super().__init__(math.prod(self.branching), distribution, variance, seed, data_dir)
+
+    def sample_scenarios(self,
+                         mean: float,
+                         num_periods: int,
+                         num_product_types: int,
+                         distribution: str,
+                         variance: float,
+                         rng: np.random.Generator):
+        if len(self.branching) != num_periods or min(self.branching) < 1:
+            raise ValueError(f"Need a branching factor >= 1 for each of the {num_periods} periods, got {self.branching}")
+        self.nodes: List[int] = []
+        self.node_periods: Dict[int, int] = {}
+        self.node_parents: Dict[int, int] = {}
+        self.node_probabilities: Dict[int, float] = {}
+        self.node_demands_mts: Dict = {}
+        self.node_demands_mto: Dict = {}
+        # nodes of the previous period, in order; the k-th node of period p
+        # is a child of the (k // branching)-th node of period p-1
+        previous = [0]
+        for p in range(1, num_periods+1):
+            first = len(self.nodes) + 1
+            num_nodes = len(previous)*self.branching[p-1]
+            demands_mts = draw_demands(rng, mean, (num_nodes, num_product_types), distribution, variance)
+            demands_mto = draw_demands(rng, mean, (num_nodes, num_product_types), distribution, variance)
+            for k in range(num_nodes):
+                n = first + k
+                self.nodes.append(n)
+                self.node_periods[n] = p
+                self.node_parents[n] = previous[k // self.branching[p-1]]
+                self.node_probabilities[n] = 1/num_nodes
+                for t in range(1, num_product_types+1):
+                    self.node_demands_mts[n, t] = int(demands_mts[k, t-1])
+                    self.node_demands_mto[n, t] = int(demands_mto[k, t-1])
+            previous = list(range(first, first + num_nodes))
+        self.leaves: List[int] = previous
+        self.num_nodes = len(self.nodes)
+
+        mts_rows = []
+        mto_rows = []
+        for s, leaf in enumerate(self.leaves, start=1):
+            n = leaf
+            while n != 0:
+                p = self.node_periods[n]
+                for t in range(1, num_product_types+1):
+                    mts_rows.append([t, p, s, self.node_demands_mts[n, t]])
+                    mto_rows.append([t, p, s, self.node_demands_mto[n, t]])
+                n = self.node_parents[n]
+        self.demands_mts_df = pd.DataFrame(mts_rows, columns=["t", "p", "s", "demand"]).sort_values(["s", "t", "p"], ignore_index=True)
+        self.demands_mto_df = pd.DataFrame(mto_rows, columns=["t", "p", "s", "demand"]).sort_values(["s", "t", "p"], ignore_index=True)
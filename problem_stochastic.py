@@ -1,6 +1,7 @@
+import copy
 import pathlib
 import re
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -45,35 +46,41 @@ def df_to_multikey_dict(df: pd.DataFrame,
     return result
 
 
+def draw_demands(rng: np.random.Generator,
+                 mean: float,
+                 size: Tuple[int, ...],
+                 distribution: str = "uniform",
+                 variance: float = 0.1) -> np.ndarray:
+    """
+    Non-negative integer demands of the given shape, drawn in C order. Drawing
+    an array consumes `rng` exactly like drawing its elements one by one, so
+    a seed yields the same demands however the draws are batched.
+    """
+    if distribution == "uniform":
+        spread = mean * variance
+        demands = rng.uniform(mean - spread, mean + spread, size)
+    elif distribution == "normal":
+        sigma = variance * mean
+        demands = rng.normal(mean, sigma, size)
+    else:
+        raise ValueError(f"Unknown distribution: {distribution}")
+    return np.maximum(0, np.rint(demands))       # ensure non-negative integer
+
+
 def generate_scenarios(mean: float,
                        num_periods: int,
                        num_product_types: int,
                        num_scenarios: int,
                        distribution: str = "uniform",
-                       variance: float = 0.1) -> pd.DataFrame:
+                       variance: float = 0.1,
+                       rng: Optional[np.random.Generator] = None) -> pd.DataFrame:
     
-    rng = np.random.default_rng()
-    rows = []
-
-    for s in range(1, num_scenarios + 1):            # scenario index
-        for t in range(1, num_product_types + 1):    # product type
-            for p in range(1, num_periods + 1):      # period
-
-                if distribution == "uniform":
-                    spread = mean * variance
-                    demand = rng.uniform(mean - spread, mean + spread)
-
-                elif distribution == "normal":
-                    sigma = variance * mean
-                    demand = rng.normal(mean, sigma)
-
-                else:
-                    raise ValueError(f"Unknown distribution: {distribution}")
-
-                demand = max(0, round(demand))       # ensure non-negative integer
-                rows.append([t, p, s, demand])
-
-    df = pd.DataFrame(rows, columns=["t", "p", "s", "demand"])
+    if rng is None:
+        rng = np.random.default_rng()
+    # demands[s][t][p], scenario, product type, period
+    demands = draw_demands(rng, mean, (num_scenarios, num_product_types, num_periods), distribution, variance)
+    s, t, p = np.indices(demands.shape) + 1
+    df = pd.DataFrame({"t": t.ravel(), "p": p.ravel(), "s": s.ravel(), "demand": demands.ravel().astype(int)})
     return df
         
     
@@ -82,8 +89,10 @@ class RPP:
     def __init__(self,
                  num_scenarios: int=2,
                  distribution: str="uniform",
-                 variance: float=0.1):
-        data_dir = pathlib.Path("clean-data")
+                 variance: float=0.1,
+                 seed: Optional[int]=None,
+                 data_dir: Union[str, pathlib.Path]="clean-data"):
+        data_dir = pathlib.Path(data_dir)
         self.data_dir = data_dir
         self.handler_initial_prices_df = pd.read_csv(data_dir/"handler_initial_price.csv")
         self.handler_borrow_prices_df = pd.read_csv(data_dir/"handler_borrow_price.csv")
@@ -101,18 +110,11 @@ class RPP:
         num_periods = len(self.demands_seed["p"].unique().tolist())
         num_product_types = len(self.demands_seed["t"].unique().tolist())
         self.num_scenarios = num_scenarios
-        self.demands_mts_df = generate_scenarios(mean,
-                                          num_periods,
-                                          num_product_types,
-                                          num_scenarios,
-                                          distribution,
-                                          variance)
-        self.demands_mto_df = generate_scenarios(mean,
-                                          num_periods,
-                                          num_product_types,
-                                          num_scenarios,
-                                          distribution,
-                                          variance)
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.demands_mts_df: pd.DataFrame
+        self.demands_mto_df: pd.DataFrame
+        self.sample_scenarios(mean, num_periods, num_product_types, distribution, variance, rng)
 
         self.demands_mts = df_to_multikey_dict(self.demands_mts_df, ["s", "p","t"], "demand")
         self.demands_mto = df_to_multikey_dict(self.demands_mto_df, ["s", "p","t"], "demand")
@@ -132,6 +134,7 @@ class RPP:
         self.handlers: List[int] = self.handler_salvage_prices_df["a"].unique().tolist()
         self.handler_categories: List[int] = self.handler_throughputs_df["h"].unique().tolist()
         self.products: List[int] = self.product_profits_df["t"].unique().tolist()
+        self.scenarios: List[int] = self.demands_mts_df["s"].unique().tolist()
         self.tester_channels: List[int] = self.tester_borrow_prices_df["z"].unique().tolist()
         self.handler_channels: List[int] = self.handler_borrow_prices_df["z"].unique().tolist()
         self.num_periods = len(self.periods)
@@ -165,6 +168,32 @@ class RPP:
 
         self.read_others()
 
+    def sample_scenarios(self,
+                         mean: float,
+                         num_periods: int,
+                         num_product_types: int,
+                         distribution: str,
+                         variance: float,
+                         rng: np.random.Generator):
+        """
+        Fill demands_mts_df and demands_mto_df with `num_scenarios`
+        independent demand paths.
+        """
+        self.demands_mts_df = generate_scenarios(mean,
+                                          num_periods,
+                                          num_product_types,
+                                          self.num_scenarios,
+                                          distribution,
+                                          variance,
+                                          rng)
+        self.demands_mto_df = generate_scenarios(mean,
+                                          num_periods,
+                                          num_product_types,
+                                          self.num_scenarios,
+                                          distribution,
+                                          variance,
+                                          rng)
+
     def read_others(self):
         other_info_filepath = self.data_dir/"others.txt"
         text:str
@@ -230,4 +259,28 @@ class RPP:
             self.tester_work_hours = df_to_multikey_dict(self.tester_work_hours_df, ["p","m"], "workhours")
             workhour_dict_list = [{"a":a, "h":h, "p":p, "workhours":workhours} for a in self.handlers for h in self.handler_categories for p in self.periods]
             self.handler_work_hours_df = pd.DataFrame(workhour_dict_list)
-            self.handler_work_hours = df_to_multikey_dict(self.handler_work_hours_df, ["p","h","a"], "workhours")
\ No newline at end of file
+            self.handler_work_hours = df_to_multikey_dict(self.handler_work_hours_df, ["p","h","a"], "workhours")
+
+    def with_scenarios(self,
+                       demands_mts: np.ndarray,
+                       demands_mto: np.ndarray) -> "RPP":
+        """
+        Copy of the instance whose scenarios are the given demand arrays,
+        indexed [scenario, period-1, product-1] as yielded by
+        ScenarioStore.batches. Scenarios are renumbered from 1.
+
+        Only the dicts read by the model are replaced; the `*_df` frames keep
+        the original sample.
+        """
+        sub_problem = copy.copy(self)
+        sub_problem.num_scenarios = len(demands_mts)
+        sub_problem.scenarios = list(range(1, sub_problem.num_scenarios+1))
+        sub_problem.demands_mts = {
+            (s, p, t): int(demands_mts[s-1, p-1, t-1])
+            for s in sub_problem.scenarios for p in self.periods for t in self.products
+        }
+        sub_problem.demands_mto = {
+            (s, p, t): int(demands_mto[s-1, p-1, t-1])
+            for s in sub_problem.scenarios for p in self.periods for t in self.products
+        }
+        return sub_problem
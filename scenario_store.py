@@ -0,0 +1,141 @@
+import json
+import math
+import os
+import pathlib
+import re
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+from problem_stochastic import RPP, draw_demands
+
+
+def demand_dtype(mean: float, distribution: str, variance: float) -> np.dtype:
+    """
+    Smallest unsigned integer type holding every demand the distribution can
+    draw. Normal draws are unbounded and clipped to uint32.
+    """
+    if distribution == "uniform":
+        return np.min_scalar_type(math.ceil(mean*(1 + variance)))
+    return np.dtype(np.uint32)
+
+
+def is_store_file(filepath: pathlib.Path) -> bool:
+    return filepath.is_file() and re.fullmatch(r"(mts|mto)-\d{5}\.npy|metadata\.json(\.tmp)?", filepath.name) is not None
+
+
+def create_store(problem: RPP,
+                 num_scenarios: int,
+                 distribution: str="uniform",
+                 variance: float=0.1,
+                 seed: Optional[int]=None,
+                 store_dir: Union[str, pathlib.Path]="scenario-store",
+                 chunk_size: int=100000) -> "ScenarioStore":
+    """
+    Sample `num_scenarios` MTS and MTO demand paths for `problem` the way
+    generate_scenarios does and write them to `store_dir`, `chunk_size`
+    scenarios at a time, so memory stays bounded by one chunk whatever the
+    sample size.
+
+    MTS and MTO demands come from two independent streams spawned from
+    `seed`, so the sample depends on the seed but not on `chunk_size`.
+    Without a seed, fresh entropy is drawn and recorded in the metadata.
+    """
+    store_dir = pathlib.Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    # an existing store is replaced, but nothing else is ever deleted
+    foreign = [filepath.name for filepath in store_dir.iterdir() if not is_store_file(filepath)]
+    if foreign:
+        raise FileExistsError(f"{store_dir} holds files that are not part of a scenario store: {sorted(foreign)[:5]}")
+    # metadata.json is written last and marks a complete store
+    metadata_filepath = store_dir/"metadata.json"
+    metadata_filepath.unlink(missing_ok=True)
+    for filepath in store_dir.iterdir():
+        if is_store_file(filepath):
+            filepath.unlink()
+
+    mean = float(problem.demands_seed["demand"].mean())
+    dtype = demand_dtype(mean, distribution, variance)
+    seed_sequence = np.random.SeedSequence(seed)
+    mts_rng, mto_rng = [np.random.default_rng(child) for child in seed_sequence.spawn(2)]
+    num_chunks = math.ceil(num_scenarios/chunk_size)
+    for i in range(num_chunks):
+        size = (min(chunk_size, num_scenarios - i*chunk_size), problem.num_periods, problem.num_products)
+        for kind, rng in [("mts", mts_rng), ("mto", mto_rng)]:
+            demands = draw_demands(rng, mean, size, distribution, variance)
+            np.save(store_dir/f"{kind}-{i:05d}.npy", np.minimum(demands, np.iinfo(dtype).max).astype(dtype))
+
+    metadata = {
+        "num_scenarios": num_scenarios,
+        "num_periods": problem.num_periods,
+        "num_products": problem.num_products,
+        "chunk_size": chunk_size,
+        "num_chunks": num_chunks,
+        "dtype": dtype.str,
+        "distribution": distribution,
+        "variance": variance,
+        "mean": mean,
+        "seed": seed,
+        "entropy": seed_sequence.entropy,
+    }
+    tmp_filepath = metadata_filepath.with_name(metadata_filepath.name + ".tmp")
+    with open(tmp_filepath, mode="w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_filepath, metadata_filepath)
+    return ScenarioStore(store_dir)
+
+
+class ScenarioStore:
+    """
+    Demand scenarios on disk, as chunks `mts-<i>.npy` and `mto-<i>.npy` of
+    shape [scenario, period-1, product-1] plus `metadata.json` with the
+    generation parameters. Written by create_store.
+
+    Chunks are opened memory-mapped and only the requested scenarios are
+    read, so iterating over a sample of any size holds one batch at a time.
+    """
+    def __init__(self, store_dir: Union[str, pathlib.Path]="scenario-store"):
+        self.store_dir = pathlib.Path(store_dir)
+        metadata_filepath = self.store_dir/"metadata.json"
+        if not metadata_filepath.exists():
+            raise FileNotFoundError(f"No complete scenario store in {self.store_dir}")
+        with open(metadata_filepath, mode="r", encoding="utf-8") as f:
+            self.metadata: Dict = json.load(f)
+        self.num_scenarios: int = self.metadata["num_scenarios"]
+        self.chunk_size: int = self.metadata["chunk_size"]
+
+    def __len__(self) -> int:
+        return self.num_scenarios
+
+    def chunk(self, kind: str, i: int) -> np.ndarray:
+        return np.load(self.store_dir/f"{kind}-{i:05d}.npy", mmap_mode="r")
+
+    def read(self, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        MTS and MTO demands of scenarios `start`..`stop-1` (0-based), copied
+        out of the chunks they span.
+        """
+        demands = {}
+        for kind in ["mts", "mto"]:
+            parts = []
+            for i in range(start//self.chunk_size, math.ceil(stop/self.chunk_size)):
+                first = i*self.chunk_size
+                parts.append(self.chunk(kind, i)[max(start, first)-first:stop-first])
+            demands[kind] = np.concatenate(parts)
+        return demands["mts"], demands["mto"]
+
+    def batches(self,
+                batch_size: int,
+                start: int=0,
+                stop: Optional[int]=None) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        Yield `(first, demands_mts, demands_mto)` for consecutive batches of
+        at most `batch_size` scenarios from `start` up to `stop`, where
+        `first` is the 0-based index of the batch's first scenario. Pass the
+        arrays to RPP.with_scenarios to build a model over the batch.
+        """
+        if stop is None:
+            stop = self.num_scenarios
+        for first in range(start, stop, batch_size):
+            demands_mts, demands_mto = self.read(first, min(first + batch_size, stop))
+            yield first, demands_mts, demands_mto
@@ -0,0 +1,194 @@
+import contextlib
+import io
+import math
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import main_deterministic
+import main_multistage
+import main_stochastic
+import problem_deterministic
+import problem_multistage
+import problem_stochastic
+
+
+def to_array(mapping: Dict, dtype: type=np.float64, fill: Any=np.nan) -> np.ndarray:
+    """
+    Dense copy of a dict keyed by 1-based integer indices (or tuples of
+    them), indexed exactly like the dict: `array[p, t] == mapping[p, t]`.
+    Index 0 and any key missing from the dict hold `fill`.
+    """
+    keys = [key if isinstance(key, tuple) else (key,) for key in mapping]
+    shape = tuple(max(key[i] for key in keys) + 1 for i in range(len(keys[0])))
+    array = np.full(shape, fill, dtype=dtype)
+    for key, value in zip(keys, mapping.values()):
+        array[key] = value
+    return array
+
+
+def is_index_map(mapping: Dict) -> bool:
+    return all(
+        type(key) is int and type(value) is int
+        for key, value in mapping.items()
+    )
+
+
+def is_id_range(value: Any) -> bool:
+    """
+    Whether `value` is a list of consecutive ints, such as scenarios, nodes
+    or leaves, which is sent as a range and rebuilt by attach.
+    """
+    return (
+        isinstance(value, list) and len(value) > 0
+        and all(type(item) is int for item in value)
+        and value == list(range(value[0], value[0] + len(value)))
+    )
+
+
+class SharedInstance:
+    """
+    Publishes the immutable data of an RPP into one shared memory block.
+
+    Every dict attribute (parameters and, for the stochastic RPP, the scenario
+    demands) becomes a float64 array in the block. Index maps, dicts from
+    int to int such as the multistage node_parents and node_periods, become
+    int64 arrays instead, since their values are used as indices. Id lists
+    (scenarios, nodes, leaves, ...) are sent as ranges, and the remaining
+    small attributes (counts, seed, ...) as they are, so `descriptor` has
+    the same size whatever the instance size. The raw `*_df` DataFrames
+    are not published. Pass `descriptor` to workers and call `attach`
+    there, or use map_problem, which does so once per worker.
+
+    The owner must call `close()` (or use it as a context manager) once all
+    workers are done.
+    """
+    def __init__(self, problem):
+        arrays = {}
+        attributes = {}
+        for name, value in vars(problem).items():
+            if isinstance(value, pd.DataFrame):
+                continue
+            if isinstance(value, dict) and is_index_map(value):
+                arrays[name] = to_array(value, np.int64, -1)
+            elif isinstance(value, dict):
+                arrays[name] = to_array(value)
+            elif is_id_range(value):
+                attributes[name] = range(value[0], value[0] + len(value))
+            else:
+                attributes[name] = value
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, sum(array.nbytes for array in arrays.values())))
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf, offset=offset)
+            view[...] = array
+            layout[name] = (array.dtype.str, array.shape, offset)
+            offset += array.nbytes
+        self.descriptor = {
+            "name": self.shm.name,
+            "problem_cls": type(problem),
+            "layout": layout,
+            "attributes": attributes,
+        }
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+attached: Dict[str, Any] = {}
+
+
+def attach(descriptor: Dict):
+    """
+    RPP whose dict attributes are read-only views into the shared block.
+    The model builders index them like the dicts (`demands_mts[s,p,t]`,
+    `tester_initial_prices[(m,)]`). Cached per process, so repeated calls
+    with the same descriptor are free.
+    """
+    name = descriptor["name"]
+    if name in attached:
+        return attached[name]
+    # pool workers share the owner's resource tracker, which only unlinks the
+    # block if the owner exits without close()
+    shm = shared_memory.SharedMemory(name=name)
+    problem_cls = descriptor["problem_cls"]
+    problem = problem_cls.__new__(problem_cls)
+    for attribute, value in descriptor["attributes"].items():
+        setattr(problem, attribute, list(value) if isinstance(value, range) else value)
+    for attribute, (dtype, shape, offset) in descriptor["layout"].items():
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+        view.flags.writeable = False
+        setattr(problem, attribute, view)
+    problem.shared_memory = shm
+    attached[name] = problem
+    return problem
+
+
+worker_problem = None
+
+
+def init_worker(descriptor: Dict):
+    global worker_problem
+    worker_problem = attach(descriptor)
+
+
+def run_task(fn: Callable, task: Any) -> Any:
+    return fn(worker_problem, task)
+
+
+def map_problem(fn: Callable,
+                problem,
+                tasks: Iterable[Any],
+                max_workers: Optional[int]=None) -> List[Any]:
+    """
+    `[fn(problem, task) for task in tasks]` on a process pool, with `problem`
+    published once into shared memory instead of being rebuilt or pickled
+    per worker. Each worker attaches once when it starts, so a task only
+    carries `fn` and `task`. `fn` must be a module-level function.
+    """
+    with SharedInstance(problem) as shared:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(shared.descriptor,)) as executor:
+            futures = [executor.submit(run_task, fn, task) for task in tasks]
+            return [future.result() for future in futures]
+
+
+def heuristic_objective(problem, presolve: bool) -> float:
+    if isinstance(problem, problem_multistage.RPP):
+        module = main_multistage
+    elif isinstance(problem, problem_stochastic.RPP):
+        module = main_stochastic
+    else:
+        module = main_deterministic
+    with contextlib.redirect_stdout(io.StringIO()):
+        return module.solve_heuristic(problem, presolve=presolve)["objective"]
+
+
+def run():
+    """
+    Check that attached instances build the same models as the originals:
+    the heuristic on every model kind, in-process and through map_problem.
+    """
+    problems = [
+        problem_deterministic.RPP(),
+        problem_stochastic.RPP(num_scenarios=5, seed=1),
+        problem_multistage.RPP([1, 1, 1, 1, 1, 1, 2, 2], seed=1),
+    ]
+    for problem in problems:
+        expected = heuristic_objective(problem, True)
+        objectives = map_problem(heuristic_objective, problem, [True, False], max_workers=2)
+        matches = all(math.isclose(objective, expected, rel_tol=1e-9) for objective in objectives)
+        print(f"{type(problem).__module__:<22s} {expected:,.2f} {'ok' if matches else objectives}")
+
+if __name__ == "__main__":
+    run()
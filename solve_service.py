@@ -0,0 +1,391 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import pathlib
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from ortools.linear_solver import pywraplp
+
+import main_deterministic
+import main_stochastic
+import problem_deterministic
+import problem_stochastic
+
+
+DEFAULT_OPTIONS = {
+    "model": "deterministic",   # "deterministic" | "stochastic"
+    "mode": "exact",            # "exact" (SCIP) | "heuristic" (LP relaxation plus repair)
+    "num_threads": 1,
+    "time_limit": None,
+    "presolve": False,
+    "problem": {},              # RPP keyword arguments, e.g. num_scenarios, seed
+}
+
+
+def data_hash(data_dir: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    for filepath in sorted(data_dir.iterdir()):
+        digest.update(filepath.name.encode())
+        digest.update(filepath.read_bytes())
+    return digest.hexdigest()
+
+
+def result_key(options: Dict, data_digest: str) -> Optional[str]:
+    """
+    Hash of the instance data and every option that changes the answer.
+    The thread count only changes how fast it is found, which is why only
+    is_reusable results are cached under this key. Stochastic instances
+    without a seed sample new scenarios on every run and are never cached.
+    """
+    if options["model"] == "stochastic" and options["problem"].get("seed") is None:
+        return None
+    keyed = {name: value for name, value in options.items() if name != "num_threads"}
+    return hashlib.sha256((data_digest + json.dumps(keyed, sort_keys=True)).encode()).hexdigest()
+
+
+def is_reusable(options: Dict, report: Dict) -> bool:
+    """
+    Heuristic results and proven optima are the same on every run. An exact
+    solve stopped by its time limit depends on the thread count and timing,
+    so it is returned once but never cached.
+    """
+    return options["mode"] == "heuristic" or report["status"] == pywraplp.Solver.OPTIMAL
+
+
+def run_job(options: Dict, data_dir: pathlib.Path, conn):
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if options["model"] == "deterministic":
+                module = main_deterministic
+                problem = problem_deterministic.RPP(**options["problem"], data_dir=data_dir)
+            else:
+                module = main_stochastic
+                problem = problem_stochastic.RPP(**options["problem"], data_dir=data_dir)
+            if options["mode"] == "heuristic":
+                report = module.solve_heuristic(problem, presolve=options["presolve"])
+            else:
+                report = module.solve(problem,
+                                      time_limit=options["time_limit"],
+                                      presolve=options["presolve"],
+                                      num_threads=options["num_threads"])
+        conn.send({"report": report})
+    except Exception as e:
+        conn.send({"error": repr(e)})
+    finally:
+        conn.close()
+
+
+class Job:
+    def __init__(self, job_id: str, options: Dict, key: Optional[str]):
+        self.id = job_id
+        self.options = options
+        self.key = key
+        self.status = "queued"  # queued | running | done | failed | cancelled
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.cached = False
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "options": self.options,
+            "cached": self.cached,
+            "result": self.result,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class SolveService:
+    """
+    FIFO job queue in front of a bounded pool of worker processes.
+
+    Every job asks for `num_threads` solver threads and is only started while
+    the threads of all running jobs fit into `total_threads`, so concurrent
+    solves never oversubscribe the machine. Reusable results (see
+    is_reusable) are kept in `result_dir` by result_key, and a submission
+    whose key is already done, queued or running is answered with that job
+    instead of a new solve. A job whose worker cannot be started or whose
+    result cannot be collected or stored is marked failed; the scheduler
+    keeps serving the others.
+    """
+    def __init__(self,
+                 total_threads: int,
+                 result_dir: str="service-results",
+                 data_dir: str="clean-data"):
+        self.total_threads = total_threads
+        self.result_dir = pathlib.Path(result_dir)
+        self.result_dir.mkdir(parents=True, exist_ok=True)
+        self.data_dir = pathlib.Path(data_dir)
+        self.jobs: Dict[str, Job] = {}
+        self.queue = deque()
+        self.running: Dict[str, Job] = {}
+        self.used_threads = 0
+        # workers are started from a multi-threaded server, where a plain
+        # fork can copy locks held by other threads
+        self.context = multiprocessing.get_context("forkserver")
+        self.condition = threading.Condition()
+        self.scheduler = threading.Thread(target=self.schedule, daemon=True)
+        self.scheduler.start()
+
+    def submit(self, options: Dict) -> Job:
+        unknown = set(options) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown options: {sorted(unknown)}")
+        options = {**DEFAULT_OPTIONS, **options}
+        if options["model"] not in ("deterministic", "stochastic"):
+            raise ValueError(f"Unknown model: {options['model']}")
+        if options["mode"] not in ("exact", "heuristic"):
+            raise ValueError(f"Unknown mode: {options['mode']}")
+        if not isinstance(options["problem"], dict):
+            raise ValueError(f"problem must be an object of RPP keyword arguments, got {options['problem']!r}")
+        if "data_dir" in options["problem"]:
+            raise ValueError("The data directory is set when the service starts, not per job")
+        options["num_threads"] = max(1, min(int(options["num_threads"]), self.total_threads))
+        key = result_key(options, data_hash(self.data_dir))
+        with self.condition:
+            if key is not None:
+                for job in self.jobs.values():
+                    if job.key == key and job.status in ("queued", "running", "done"):
+                        return job
+            job = Job(uuid.uuid4().hex, options, key)
+            self.jobs[job.id] = job
+            result = self.load_result(key)
+            if result is not None:
+                job.status = "done"
+                job.result = result
+                job.cached = True
+                job.finished_at = time.time()
+            else:
+                self.queue.append(job)
+                self.condition.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self.condition:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == "queued":
+                self.queue.remove(job)
+            elif job.status == "running":
+                job.process.terminate()
+                job.process.join()
+                self.finish(job)
+            else:
+                return job
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return job
+
+    def load_result(self, key: Optional[str]) -> Optional[Dict]:
+        if key is None:
+            return None
+        filepath = self.result_dir/f"{key}.json"
+        if not filepath.exists():
+            return None
+        with open(filepath, mode="r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def store_result(self, key: Optional[str], result: Dict):
+        if key is None:
+            return
+        filepath = self.result_dir/f"{key}.json"
+        tmp_filepath = filepath.with_name(filepath.name + ".tmp")
+        with open(tmp_filepath, mode="w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(tmp_filepath, filepath)
+
+    def schedule(self):
+        while True:
+            with self.condition:
+                self.collect()
+                while self.queue and self.used_threads + self.queue[0].options["num_threads"] <= self.total_threads:
+                    job = self.queue.popleft()
+                    try:
+                        self.start(job)
+                    except Exception as e:
+                        self.fail(job, e)
+                self.condition.wait(timeout=0.2)
+
+    def start(self, job: Job):
+        parent_conn, child_conn = self.context.Pipe(duplex=False)
+        try:
+            job.process = self.context.Process(target=run_job, args=(job.options, self.data_dir, child_conn), daemon=True)
+            job.process.start()
+        except Exception:
+            parent_conn.close()
+            raise
+        finally:
+            child_conn.close()
+        job.conn = parent_conn
+        job.status = "running"
+        job.started_at = time.time()
+        self.running[job.id] = job
+        self.used_threads += job.options["num_threads"]
+
+    def finish(self, job: Job):
+        del self.running[job.id]
+        self.used_threads -= job.options["num_threads"]
+        job.conn.close()
+
+    def fail(self, job: Job, error: Exception):
+        if job.id in self.running:
+            if job.process.is_alive():
+                job.process.terminate()
+            job.process.join()
+            self.finish(job)
+        job.status = "failed"
+        job.error = repr(error)
+        job.finished_at = time.time()
+
+    def collect(self):
+        for job in list(self.running.values()):
+            try:
+                if not job.conn.poll():
+                    continue
+                try:
+                    message = job.conn.recv()
+                except EOFError:
+                    message = {"error": f"Worker exited with code {job.process.exitcode}"}
+                job.process.join()
+                self.finish(job)
+                job.finished_at = time.time()
+                if "error" in message:
+                    job.status = "failed"
+                    job.error = message["error"]
+                else:
+                    job.status = "done"
+                    job.result = message["report"]
+                    if is_reusable(job.options, job.result):
+                        self.store_result(job.key, job.result)
+                    else:
+                        # later submissions get a fresh solve, not this result
+                        job.key = None
+            except Exception as e:
+                self.fail(job, e)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs with a JSON options body submits, GET /jobs lists,
+    GET /jobs/<id> reports status and result, DELETE /jobs/<id> cancels.
+    """
+    def send_json(self, code: int, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def job_id(self) -> Optional[str]:
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "jobs":
+            return parts[1]
+        return None
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = self.server.service.submit(json.loads(self.rfile.read(length) or b"{}"))
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(200, job.to_dict())
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/jobs":
+            self.send_json(200, [job.to_dict() for job in self.server.service.list_jobs()])
+            return
+        job = self.server.service.get(self.job_id())
+        if job is None:
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, job.to_dict())
+
+    def do_DELETE(self):
+        job = self.server.service.cancel(self.job_id())
+        if job is None:
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, job.to_dict())
+
+
+def serve(host: str, port: int, total_threads: int, data_dir: str="clean-data"):
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = SolveService(total_threads, data_dir=data_dir)
+    print(f"Serving on http://{host}:{port} with {total_threads} threads")
+    server.serve_forever()
+
+
+def request(url: str, method: str="GET", payload: Optional[Dict]=None):
+    data = None if payload is None else json.dumps(payload).encode()
+    req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Local RPP solve service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--threads", type=int, default=os.cpu_count())
+    serve_parser.add_argument("--data-dir", default="clean-data")
+    submit_parser = subparsers.add_parser("submit")
+    submit_parser.add_argument("options", help='JSON options, e.g. \'{"model": "stochastic", "problem": {"seed": 1}}\'')
+    status_parser = subparsers.add_parser("status")
+    status_parser.add_argument("job_id", nargs="?")
+    cancel_parser = subparsers.add_parser("cancel")
+    cancel_parser.add_argument("job_id")
+    args = parser.parse_args()
+
+    url = f"http://{args.host}:{args.port}/jobs"
+    if args.command == "serve":
+        serve(args.host, args.port, args.threads, args.data_dir)
+        return
+    if args.command == "submit":
+        response = request(url, "POST", json.loads(args.options))
+    elif args.command == "status":
+        response = request(url if args.job_id is None else f"{url}/{args.job_id}")
+    else:
+        response = request(f"{url}/{args.job_id}", "DELETE")
+    print(json.dumps(response, indent=2))
+
+if __name__ == "__main__":
+    run()